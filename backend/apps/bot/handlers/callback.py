@@ -48,9 +48,9 @@ async def _handle_meal_type_callback(bot: TelegramBot, from_user: dict, chat_id:
     if not telegram_user_id:
         return
 
-    # Find client
+    # Find client (persona и coach нужны дальше при проверке программы питания)
     client = await sync_to_async(
-        lambda: Client.objects.filter(telegram_user_id=telegram_user_id).first()
+        lambda: Client.objects.select_related('persona', 'coach').filter(telegram_user_id=telegram_user_id).first()
     )()
     if not client:
         logger.warning('[CALLBACK] Client not found for tg_user=%s', telegram_user_id)
@@ -148,7 +148,10 @@ async def _get_or_create_client(bot: TelegramBot, from_user: dict) -> Client:
     """Get or create a client from Telegram user data."""
     telegram_user_id = from_user['id']
 
-    client, created = await sync_to_async(Client.objects.get_or_create)(
+    # persona и coach нужны обработчикам (в т.ч. проверке программы питания)
+    client, created = await sync_to_async(
+        Client.objects.select_related('persona', 'coach').get_or_create
+    )(
         telegram_user_id=telegram_user_id,
         defaults={
             'coach': bot.coach,
@@ -9,7 +9,7 @@ from django.utils import timezone
 
 from apps.accounts.models import Client
 from apps.bot.services import _build_client_context
-from apps.nutrition_programs.services import process_meal_compliance
+from apps.nutrition_programs.services import get_persona_provider_config, process_meal_compliance
 from apps.persona.models import AIProviderConfig, BotPersona, TelegramBot
 from core.ai.factory import get_ai_provider
 from core.ai.model_fetcher import log_ai_usage
@@ -921,6 +921,42 @@ async def check_meal_program_compliance(meal: Meal) -> tuple[str | None, bool]:
         return None, True
 
 
+def _load_ai_compliance_feedback_context(meal: Meal, check) -> tuple | None:
+    """
+    Загружает всё, что нужно для AI feedback по программе питания, синхронно.
+
+    Вызывается одним sync_to_async вместо отдельного перехода в sync-поток
+    на каждое обращение к связанным объектам.
+
+    Returns:
+        (client, coach, persona, program_day, program, provider_name, config)
+        или None, если у персоны нет промпта или нет конфига провайдера
+    """
+    client = meal.client
+    coach = client.coach
+
+    # Получаем persona клиента (или дефолтную коуча)
+    persona = client.persona
+    if not persona:
+        bot = TelegramBot.objects.filter(coach=coach).first()
+        if bot:
+            persona = BotPersona.objects.filter(coach_id=bot.coach_id).first()
+
+    if not persona or not persona.nutrition_program_prompt:
+        return None
+
+    # День программы (program уже подгружен в process_meal_compliance)
+    program_day = check.program_day
+    program = program_day.program
+
+    provider_name, config = get_persona_provider_config(coach.pk, persona)
+    if not config:
+        logger.warning('[COMPLIANCE AI] No API config for provider %s', provider_name)
+        return None
+
+    return client, coach, persona, program_day, program, provider_name, config
+
+
 async def _generate_ai_compliance_feedback(
     meal: Meal,
     check,
@@ -932,44 +968,15 @@ async def _generate_ai_compliance_feedback(
     Returns:
         AI-сгенерированный feedback или None если промпта нет
     """
-    from apps.nutrition_programs.models import MealComplianceCheck
-    from core.ai.factory import get_ai_provider
-
     try:
-        # Получаем клиента
-        client = await sync_to_async(lambda: meal.client)()
-
-        # Получаем persona клиента (или дефолтную коуча)
-        persona = await sync_to_async(lambda: client.persona)()
-        if not persona:
-            bot = await sync_to_async(
-                lambda: TelegramBot.objects.filter(coach=client.coach).first()
-            )()
-            if bot:
-                persona = await sync_to_async(
-                    lambda: BotPersona.objects.filter(coach=bot.coach).first()
-                )()
-
-        if not persona or not persona.nutrition_program_prompt:
+        # Весь контекст из БД — за один переход в sync-поток
+        context = await sync_to_async(_load_ai_compliance_feedback_context)(meal, check)
+        if context is None:
             return None
-
-        # Получаем день программы
-        program_day = await sync_to_async(lambda: check.program_day)()
-        program = await sync_to_async(lambda: program_day.program)()
+        client, coach, persona, program_day, program, provider_name, config = context
 
         # Получаем provider
-        provider_name = persona.text_provider or 'openai'
         model = persona.text_model or None
-
-        config = await sync_to_async(
-            lambda: AIProviderConfig.objects.filter(
-                coach=client.coach, provider=provider_name, is_active=True
-            ).first()
-        )()
-        if not config:
-            logger.warning('[COMPLIANCE AI] No API config for provider %s', provider_name)
-            return None
-
         provider = get_ai_provider(provider_name, config.api_key)
 
         # Формируем контекст
@@ -1002,7 +1009,7 @@ async def _generate_ai_compliance_feedback(
         )
 
         # Log usage
-        await log_ai_usage(client.coach, provider_name, model, response, task_type='text', client=client)
+        await log_ai_usage(coach, provider_name, model, response, task_type='text', client=client)
 
         logger.info('[COMPLIANCE AI] Generated feedback for meal=%s', meal.pk)
         return response.content
@@ -1755,7 +1762,10 @@ async def confirm_draft(draft: 'MealDraft') -> Meal:
 
     try:
         # Явно загружаем client (ForeignKey lazy loading проблема в async)
-        client = await sync_to_async(lambda: draft.client)()
+        # вместе с persona и coach — они нужны при проверке программы питания
+        client = await sync_to_async(
+            Client.objects.select_related('persona', 'coach').get
+        )(pk=draft.client_id)
         logger.info('[SMART CONFIRM] Client loaded: %s', client.pk)
 
         # Преобразуем ингредиенты в простой список для Meal
@@ -5,3 +5,7 @@ class NutritionProgramsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.nutrition_programs'
     verbose_name = 'Программы питания'
+
+    def ready(self) -> None:
+        """Подключение сигналов при загрузке приложения."""
+        import apps.nutrition_programs.signals  # noqa: F401
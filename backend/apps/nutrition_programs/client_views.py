@@ -44,11 +44,14 @@ class NutritionProgramTodayView(APIView):
             return Response({'has_program': False})
 
         # Статистика за сегодня
-        today_checks = MealComplianceCheck.objects.filter(
+        today_stats = MealComplianceCheck.objects.filter(
             program_day=program_day,
+        ).aggregate(
+            total=Count('id'),
+            compliant=Count('id', filter=Q(is_compliant=True)),
         )
-        meals_count = today_checks.count()
-        compliant_meals = today_checks.filter(is_compliant=True).count()
+        meals_count = today_stats['total']
+        compliant_meals = today_stats['compliant']
         violations_count = meals_count - compliant_meals
 
         return Response({
@@ -209,9 +212,12 @@ class NutritionProgramSummaryView(APIView):
         current_day = program_day.day_number if program_day else None
 
         # Общая статистика
-        total_checks = MealComplianceCheck.objects.filter(program_day__program=program)
-        total_meals = total_checks.count()
-        total_compliant = total_checks.filter(is_compliant=True).count()
+        total_stats = MealComplianceCheck.objects.filter(program_day__program=program).aggregate(
+            total=Count('id'),
+            compliant=Count('id', filter=Q(is_compliant=True)),
+        )
+        total_meals = total_stats['total']
+        total_compliant = total_stats['compliant']
         compliance_rate = round(total_compliant / total_meals * 100) if total_meals > 0 else None
 
         return Response({
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('nutrition_programs', '0006_nutritionprogram_track_compliance'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='nutritionprogram',
+            name='nutrition_p_client__27e6ea_idx',
+        ),
+        migrations.AddIndex(
+            model_name='nutritionprogram',
+            index=models.Index(fields=['client', 'status', 'start_date'], name='nutrition_p_client__f77e04_idx'),
+        ),
+    ]
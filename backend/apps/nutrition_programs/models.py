@@ -2,6 +2,7 @@ import re
 
 from django.core.exceptions import ValidationError
 from django.db import models
+from rapidfuzz.utils import default_process
 
 
 def validate_meals_structure(value):
@@ -50,6 +51,30 @@ def validate_meals_structure(value):
                 )
 
 
+def normalize_dish_text(text: str) -> str:
+    """
+    Нормализует текст блюда для fuzzy-сравнения.
+
+    default_process (lowercase, без пунктуации) + токены в алфавитном порядке —
+    fuzz.ratio по таким строкам эквивалентен token_sort_ratio без повторной
+    токенизации.
+    """
+    processed = default_process(text)
+    # Одно слово (частый случай для ингредиентов) — сортировать нечего
+    if processed.isalnum():
+        return processed
+    return ' '.join(sorted(processed.split()))
+
+
+def _ingredient_names(items) -> list[str]:
+    """Непустые названия из списка ингредиентов [{'name': ...}] — один get на элемент."""
+    return [
+        name
+        for ing in items or []
+        if isinstance(ing, dict) and (name := ing.get('name'))
+    ]
+
+
 class NutritionProgram(models.Model):
     """Программа питания для клиента."""
 
@@ -101,7 +126,10 @@ class NutritionProgram(models.Model):
         verbose_name = 'Программа питания'
         verbose_name_plural = 'Программы питания'
         indexes = [
-            models.Index(fields=['client', 'status']),
+            # Поиск активной программы клиента: равенство по client и status,
+            # диапазон по start_date; префикс (client, status) покрывает
+            # остальные выборки программ клиента по статусу
+            models.Index(fields=['client', 'status', 'start_date']),
             models.Index(fields=['client', 'start_date', 'end_date']),
             models.Index(fields=['coach', 'status']),
         ]
@@ -181,23 +209,20 @@ class NutritionProgramDay(models.Model):
     def __str__(self):
         return f'{self.program.name} - День {self.day_number}'
 
+    def save(self, *args, **kwargs):
+        # meals могли измениться — сбрасываем кэш нормализованных текстов
+        self.__dict__.pop('_normalized_planned_text', None)
+        super().save(*args, **kwargs)
+
     @property
     def allowed_ingredients_list(self) -> list[str]:
         """Возвращает список названий разрешённых ингредиентов."""
-        return [
-            ing.get('name', '')
-            for ing in self.allowed_ingredients
-            if isinstance(ing, dict) and ing.get('name')
-        ]
+        return _ingredient_names(self.allowed_ingredients)
 
     @property
     def forbidden_ingredients_list(self) -> list[str]:
         """Возвращает список названий запрещённых ингредиентов."""
-        return [
-            ing.get('name', '')
-            for ing in self.forbidden_ingredients
-            if isinstance(ing, dict) and ing.get('name')
-        ]
+        return _ingredient_names(self.forbidden_ingredients)
 
     def get_meal_by_type(self, meal_type: str) -> dict | None:
         """Возвращает приём пищи по типу (breakfast, lunch, dinner и т.д.)."""
@@ -206,6 +231,22 @@ class NutritionProgramDay(models.Model):
                 return meal
         return None
 
+    def get_normalized_planned_text(self, meal_type: str) -> str:
+        """
+        Нормализованный текст запланированного блюда (название + описание).
+
+        Кэшируется на экземпляре по meal_type, чтобы при проверке нескольких
+        приёмов пищи одного дня текст плана готовился один раз.
+        """
+        cache = self.__dict__.setdefault('_normalized_planned_text', {})
+        if meal_type not in cache:
+            meal = self.get_meal_by_type(meal_type)
+            text = ''
+            if meal:
+                text = normalize_dish_text(f"{meal.get('name', '')} {meal.get('description', '')}")
+            cache[meal_type] = text
+        return cache[meal_type]
+
     def get_meals_list(self) -> list[dict]:
         """Возвращает отсортированный список приёмов пищи."""
         type_order = {choice[0]: idx for idx, choice in enumerate(self.MEAL_TYPE_CHOICES)}
@@ -341,8 +382,10 @@ class MealReport(models.Model):
     def recognized_ingredients_list(self) -> list[str]:
         """Возвращает список названий распознанных ингредиентов."""
         if isinstance(self.recognized_ingredients, list):
+            # Строки допустимы в старых отчётах; dict без name не попадает в список
             return [
-                ing.get('name', ing) if isinstance(ing, dict) else str(ing)
+                name
                 for ing in self.recognized_ingredients
+                if (name := ing.get('name') if isinstance(ing, dict) else str(ing))
             ]
         return []
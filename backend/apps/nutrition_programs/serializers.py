@@ -1,8 +1,30 @@
+from django.db.models import Count, Q
 from rest_framework import serializers
 
 from .models import MealComplianceCheck, MealReport, NutritionProgram, NutritionProgramDay
 
 
+def normalize_ingredients(items: list) -> list:
+    """
+    Нормализует список ингредиентов дня при сохранении.
+
+    Убирает пустые названия и дубли (без учёта регистра), сохраняя порядок
+    и исходное написание первого вхождения — чтобы при проверке соответствия
+    списки можно было сразу использовать для set-lookup.
+    """
+    seen = set()
+    result = []
+    for ing in items or []:
+        if not isinstance(ing, dict):
+            continue
+        key = str(ing.get('name', '')).strip().lower()
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        result.append(ing)
+    return result
+
+
 class NutritionProgramDaySerializer(serializers.ModelSerializer):
     """Serializer для дня программы питания."""
 
@@ -68,13 +90,15 @@ class NutritionProgramSerializer(serializers.ModelSerializer):
             if total == 0:
                 return None
             return round(obj._compliant_checks / total * 100, 1)
-        # Fallback для случаев без аннотаций (retrieve, etc.)
-        checks = MealComplianceCheck.objects.filter(program_day__program=obj)
-        total = checks.count()
+        # Fallback для случаев без аннотаций (retrieve, etc.) — один запрос
+        stats = MealComplianceCheck.objects.filter(program_day__program=obj).aggregate(
+            total=Count('id'),
+            compliant=Count('id', filter=Q(is_compliant=True)),
+        )
+        total = stats['total']
         if total == 0:
             return None
-        compliant = checks.filter(is_compliant=True).count()
-        return round(compliant / total * 100, 1)
+        return round(stats['compliant'] / total * 100, 1)
 
     def get_current_day(self, obj) -> int | None:
         """Номер текущего дня программы (1-based) или None если вне диапазона."""
@@ -95,11 +119,26 @@ class NutritionProgramDetailSerializer(NutritionProgramSerializer):
         fields = NutritionProgramSerializer.Meta.fields + ['days']
 
 
+class NutritionProgramDayInputSerializer(serializers.Serializer):
+    """
+    Входные данные дня при создании/обновлении программы.
+
+    Поля без default: в update() обновляются только переданные ключи.
+    """
+
+    day_number = serializers.IntegerField(required=False, min_value=1)
+    meals = serializers.ListField(child=serializers.DictField(), required=False)
+    activity = serializers.CharField(required=False, allow_blank=True)
+    allowed_ingredients = serializers.ListField(child=serializers.DictField(), required=False)
+    forbidden_ingredients = serializers.ListField(child=serializers.DictField(), required=False)
+    notes = serializers.CharField(required=False, allow_blank=True)
+
+
 class NutritionProgramCreateSerializer(serializers.ModelSerializer):
     """Serializer для создания программы."""
 
-    days = serializers.ListField(
-        child=serializers.DictField(),
+    days = NutritionProgramDayInputSerializer(
+        many=True,
         required=False,
         default=list,
         help_text='Список дней с ингредиентами',
@@ -148,11 +187,12 @@ class NutritionProgramCreateSerializer(serializers.ModelSerializer):
             if self.instance:
                 overlapping = overlapping.exclude(pk=self.instance.pk)
 
-            if overlapping.exists():
-                program = overlapping.first()
+            # Один узкий запрос вместо exists() + first() с полной моделью
+            program = overlapping.values('name', 'start_date', 'end_date').first()
+            if program:
                 raise serializers.ValidationError({
-                    'start_date': f'Даты пересекаются с активной программой "{program.name}" '
-                                  f'({program.start_date} - {program.end_date})'
+                    'start_date': f'Даты пересекаются с активной программой "{program["name"]}" '
+                                  f'({program["start_date"]} - {program["end_date"]})'
                 })
 
         return attrs
@@ -165,18 +205,22 @@ class NutritionProgramCreateSerializer(serializers.ModelSerializer):
         program = NutritionProgram.objects.create(**validated_data)
 
         # Создаём дни программы
-        from datetime import timedelta
+        from datetime import date
+
+        # Даты дней считаем через ordinal — без создания timedelta на каждой итерации
+        start_ordinal = program.start_date.toordinal()
+        dates = [date.fromordinal(start_ordinal + i) for i in range(program.duration_days)]
 
-        for i in range(program.duration_days):
+        for i, day_date in enumerate(dates):
             day_data = days_data[i] if i < len(days_data) else {}
             NutritionProgramDay.objects.create(
                 program=program,
                 day_number=i + 1,
-                date=program.start_date + timedelta(days=i),
+                date=day_date,
                 meals=day_data.get('meals', []),
                 activity=day_data.get('activity', ''),
-                allowed_ingredients=day_data.get('allowed_ingredients', []),
-                forbidden_ingredients=day_data.get('forbidden_ingredients', []),
+                allowed_ingredients=normalize_ingredients(day_data.get('allowed_ingredients', [])),
+                forbidden_ingredients=normalize_ingredients(day_data.get('forbidden_ingredients', [])),
                 notes=day_data.get('notes', ''),
             )
 
@@ -203,9 +247,13 @@ class NutritionProgramCreateSerializer(serializers.ModelSerializer):
                     if 'activity' in day_data:
                         update_fields['activity'] = day_data['activity']
                     if 'allowed_ingredients' in day_data:
-                        update_fields['allowed_ingredients'] = day_data['allowed_ingredients']
+                        update_fields['allowed_ingredients'] = normalize_ingredients(
+                            day_data['allowed_ingredients']
+                        )
                     if 'forbidden_ingredients' in day_data:
-                        update_fields['forbidden_ingredients'] = day_data['forbidden_ingredients']
+                        update_fields['forbidden_ingredients'] = normalize_ingredients(
+                            day_data['forbidden_ingredients']
+                        )
                     if 'notes' in day_data:
                         update_fields['notes'] = day_data['notes']
 
@@ -1,24 +1,41 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import date, datetime
-from typing import TYPE_CHECKING
-
-import pytz
-from django.db.models import QuerySet
+import functools
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, tzinfo
+from typing import TYPE_CHECKING, Callable
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Q, QuerySet
+# orjson заметно быстрее stdlib json; orjson.JSONDecodeError — подкласс
+# json.JSONDecodeError, поэтому обработка ошибок не меняется
+from orjson import loads as json_loads
 from rapidfuzz import fuzz, process
 
+from apps.persona.models import AIProviderConfig, BotPersona, TelegramBot
+from core.ai.factory import get_ai_provider
+from core.ai.model_fetcher import log_ai_usage
 from core.ai.utils import strip_markdown_codeblock
 
 if TYPE_CHECKING:
     from apps.accounts.models import Client
     from apps.meals.models import Meal
 
-from .models import MealComplianceCheck, NutritionProgram, NutritionProgramDay
+from .models import MealComplianceCheck, MealReport, NutritionProgram, NutritionProgramDay, normalize_dish_text
 
+logger = logging.getLogger(__name__)
 
 DEFAULT_TIMEZONE = 'Europe/Moscow'
 
+# Маркеры отказа AI анализировать фото (один проход regex без lower()-копий)
+_REFUSAL_RE = re.compile(r"извините|не могу|i can'?t|i cannot|sorry|unable to", re.IGNORECASE)
+# Отказ всегда в начале ответа — дальше первых символов не сканируем
+_REFUSAL_SCAN_LIMIT = 400
+
 
 @dataclass
 class ComplianceResult:
@@ -42,7 +59,23 @@ MEAL_TIME_RANGES = {
 }
 
 
-def get_meal_type_by_time(meal_time: datetime, client_tz: pytz.BaseTzInfo = None) -> str:
+def _classify_hour(hour: int) -> str:
+    """Тип приёма пищи для часа (0-23) по MEAL_TIME_RANGES."""
+    for meal_type, (start_hour, end_hour) in MEAL_TIME_RANGES.items():
+        if start_hour <= hour < end_hour:
+            return meal_type
+
+    # По умолчанию - перекус
+    if hour < 6:
+        return 'dinner'  # поздний ужин
+    return 'snack2'  # поздний перекус
+
+
+# Таблица час -> тип приёма пищи, строится один раз при импорте
+_HOUR_TO_MEAL_TYPE = tuple(_classify_hour(hour) for hour in range(24))
+
+
+def get_meal_type_by_time(meal_time: datetime, client_tz: tzinfo | None = None) -> str:
     """
     Определяет тип приёма пищи по времени.
 
@@ -58,29 +91,26 @@ def get_meal_type_by_time(meal_time: datetime, client_tz: pytz.BaseTzInfo = None
     else:
         local_time = meal_time
 
-    hour = local_time.hour
+    return _HOUR_TO_MEAL_TYPE[local_time.hour]
 
-    for meal_type, (start_hour, end_hour) in MEAL_TIME_RANGES.items():
-        if start_hour <= hour < end_hour:
-            return meal_type
 
-    # По умолчанию - перекус
-    if hour < 6:
-        return 'dinner'  # поздний ужин
-    return 'snack2'  # поздний перекус
+@functools.lru_cache(maxsize=512)
+def _get_zone(name: str) -> tzinfo:
+    """ZoneInfo по имени с кэшированием (невалидное имя — дефолтный timezone)."""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
 
 
-def get_client_timezone(client: Client) -> pytz.BaseTzInfo:
+def get_client_timezone(client: Client) -> tzinfo:
     """
     Безопасно получает timezone клиента.
 
     Returns:
         Timezone клиента или дефолтный если невалидный
     """
-    try:
-        return pytz.timezone(client.timezone or DEFAULT_TIMEZONE)
-    except pytz.UnknownTimezoneError:
-        return pytz.timezone(DEFAULT_TIMEZONE)
+    return _get_zone(client.timezone or DEFAULT_TIMEZONE)
 
 
 def get_client_today(client: Client) -> date:
@@ -89,6 +119,16 @@ def get_client_today(client: Client) -> date:
     return datetime.now(tz).date()
 
 
+@functools.lru_cache(maxsize=256)
+def _default_persona(coach_id: int) -> BotPersona | None:
+    """
+    Персона коуча по умолчанию (для клиентов без своей персоны).
+
+    Кэш сбрасывается сигналами сохранения/удаления BotPersona (signals.py).
+    """
+    return BotPersona.objects.filter(coach_id=coach_id, is_default=True).first()
+
+
 def get_active_program_for_client(
     client: Client,
     target_date: date | None = None,
@@ -133,16 +173,15 @@ def get_program_day(
 
     day_number = (target_date - program.start_date).days + 1
 
-    return NutritionProgramDay.objects.filter(
-        program=program,
-        day_number=day_number,
-    ).first()
+    # Через related manager: у найденного дня program уже заполнен
+    # (known related objects), без второго SELECT при обращении к day.program
+    return program.days.filter(day_number=day_number).first()
 
 
 def check_meal_compliance(
     meal: Meal,
     program_day: NutritionProgramDay,
-    client_tz: pytz.BaseTzInfo | None = None,
+    client_tz: tzinfo | None = None,
 ) -> ComplianceResult:
     """
     Проверяет соответствие приёма пищи программе питания.
@@ -157,40 +196,66 @@ def check_meal_compliance(
     Returns:
         ComplianceResult с результатами проверки
     """
-    # Определяем тип приёма пищи по времени
-    meal_type = None
-    planned_meal = None
-    compliance_score = 70  # По умолчанию средний score
-
-    if meal.meal_time:
-        meal_type = get_meal_type_by_time(meal.meal_time, client_tz)
-        # Получаем запланированное блюдо из программы
-        planned_meal = program_day.get_meal_by_type(meal_type)
-
-        # Если есть запланированное блюдо, проверяем соответствие
-        if planned_meal and meal.dish_name:
-            planned_name = planned_meal.get('name', '')
-            planned_description = planned_meal.get('description', '')
-            planned_text = f"{planned_name} {planned_description}".strip()
-
-            if planned_text:
-                # Fuzzy сравнение названий блюд
-                similarity = fuzz.token_sort_ratio(
-                    meal.dish_name.lower(),
-                    planned_text.lower()
-                )
-                # Преобразуем similarity в compliance_score
-                compliance_score = similarity
+    return check_meal_compliance_bulk([meal], program_day, client_tz=client_tz)[0]
 
-    is_compliant = compliance_score >= 70
 
-    return ComplianceResult(
-        is_compliant=is_compliant,
-        compliance_score=compliance_score,
-        meal_type=meal_type,
-        planned_meal=planned_meal,
-        recognized_dish=meal.dish_name or '',
-    )
+def check_meal_compliance_bulk(
+    meals: list[Meal],
+    program_day: NutritionProgramDay,
+    client_tz: tzinfo | None = None,
+) -> list[ComplianceResult]:
+    """
+    Проверяет соответствие нескольких приёмов пищи одному дню программы.
+
+    Нормализованный текст плана для каждого типа приёма пищи готовится один
+    раз (кэш на program_day) и переиспользуется для всех блюд этого типа.
+    Повторяющиеся блюда одного типа оцениваются один раз за вызов.
+
+    Args:
+        meals: Приёмы пищи с распознанными названиями
+        program_day: День программы питания
+        client_tz: Timezone клиента для определения типа приёма пищи
+
+    Returns:
+        Список ComplianceResult в том же порядке, что и meals
+    """
+    results = []
+    # (тип приёма пищи, название блюда) -> score: в массовых проверках
+    # одно и то же блюдо встречается многократно
+    scores: dict[tuple[str, str], float] = {}
+
+    for meal in meals:
+        # Определяем тип приёма пищи по времени
+        meal_type = None
+        planned_meal = None
+        compliance_score = 70  # По умолчанию средний score
+
+        if meal.meal_time:
+            meal_type = get_meal_type_by_time(meal.meal_time, client_tz)
+            # Получаем запланированное блюдо из программы
+            planned_meal = program_day.get_meal_by_type(meal_type)
+            # Текст плана нормализуется один раз на тип и кэшируется на program_day
+            planned_text = program_day.get_normalized_planned_text(meal_type)
+
+            # Если есть запланированное блюдо, проверяем соответствие
+            if planned_text and meal.dish_name:
+                key = (meal_type, meal.dish_name)
+                compliance_score = scores.get(key)
+                if compliance_score is None:
+                    # Обе строки уже с отсортированными токенами — fuzz.ratio
+                    # даёт тот же результат, что token_sort_ratio
+                    compliance_score = fuzz.ratio(normalize_dish_text(meal.dish_name), planned_text)
+                    scores[key] = compliance_score
+
+        results.append(ComplianceResult(
+            is_compliant=compliance_score >= 70,
+            compliance_score=compliance_score,
+            meal_type=meal_type,
+            planned_meal=planned_meal,
+            recognized_dish=meal.dish_name or '',
+        ))
+
+    return results
 
 
 def generate_compliance_feedback(
@@ -211,21 +276,18 @@ def generate_compliance_feedback(
     Returns:
         Текст для пользователя
     """
+    # Используем AI анализ если есть — шаблон не нужен
+    if compliance_result.ai_analysis:
+        return compliance_result.ai_analysis
+
     # Информация о запланированном блюде
     planned_meal_text = ''
     if compliance_result.planned_meal:
-        planned_name = compliance_result.planned_meal.get('name', '')
-        planned_description = compliance_result.planned_meal.get('description', '')
-        planned_meal_text = planned_description or planned_name
-        planned_meal_text = planned_meal_text[:150]
+        planned_meal = compliance_result.planned_meal
+        planned_meal_text = (planned_meal.get('description') or planned_meal.get('name') or '')[:150]
 
-    recognized = compliance_result.recognized_dish
     score = compliance_result.compliance_score
 
-    # Используем AI анализ если есть
-    if compliance_result.ai_analysis:
-        return compliance_result.ai_analysis
-
     # Генерируем feedback на основе score
     if score >= 90:
         if planned_meal_text:
@@ -266,12 +328,43 @@ def create_compliance_check(
     Returns:
         Созданный объект MealComplianceCheck
     """
-    return MealComplianceCheck.objects.create(
+    check = _build_compliance_check(meal, program_day, compliance_result, ai_comment)
+    check.save(force_insert=True)
+    return check
+
+
+def create_compliance_checks_bulk(
+    items: list[tuple[Meal, NutritionProgramDay, ComplianceResult, str]],
+) -> list[MealComplianceCheck]:
+    """
+    Создаёт записи проверок соответствия пачкой (для массовой обработки).
+
+    Один INSERT на batch вместо запроса на каждый приём пищи; пара к
+    check_meal_compliance_bulk.
+
+    Args:
+        items: Кортежи (приём пищи, день программы, результат проверки, комментарий AI)
+
+    Returns:
+        Созданные объекты MealComplianceCheck в порядке items
+    """
+    return MealComplianceCheck.objects.bulk_create(
+        [_build_compliance_check(*item) for item in items],
+        batch_size=500,
+    )
+
+
+def _build_compliance_check(
+    meal: Meal,
+    program_day: NutritionProgramDay,
+    compliance_result: ComplianceResult,
+    ai_comment: str = '',
+) -> MealComplianceCheck:
+    return MealComplianceCheck(
         meal=meal,
         program_day=program_day,
         is_compliant=compliance_result.is_compliant,
-        found_forbidden=[],  # Deprecated: оставлено для обратной совместимости
-        found_allowed=[],  # Deprecated: оставлено для обратной совместимости
+        # found_forbidden / found_allowed устарели — остаются default=list модели
         ai_comment=ai_comment or compliance_result.ai_analysis,
     )
 
@@ -314,10 +407,7 @@ def process_meal_compliance(
     result = check_meal_compliance(meal, program_day, client_tz=client_tz)
 
     # Получаем персону клиента для кастомного промпта
-    persona = client.persona
-    if not persona:
-        from apps.persona.models import BotPersona
-        persona = BotPersona.objects.filter(coach=client.coach, is_default=True).first()
+    persona = client.persona or _default_persona(client.coach_id)
 
     # Генерируем feedback
     feedback = generate_compliance_feedback(result, program_day, persona)
@@ -328,6 +418,57 @@ def process_meal_compliance(
     return check, feedback
 
 
+def process_meal_compliance_bulk(
+    meals: list[Meal],
+) -> list[tuple[MealComplianceCheck | None, str]]:
+    """
+    Проверка нескольких приёмов пищи на соответствие программе питания.
+
+    Тот же flow, что process_meal_compliance, но день программы ищется один
+    раз на (клиент, дата), блюда оцениваются через check_meal_compliance_bulk,
+    а проверки сохраняются одним bulk_create.
+
+    Args:
+        meals: Приёмы пищи (клиент должен быть загружен или закэширован на объекте)
+
+    Returns:
+        Кортежи (MealComplianceCheck или None, текст feedback) в порядке meals
+    """
+    results: list[tuple[MealComplianceCheck | None, str]] = [(None, '')] * len(meals)
+
+    # (клиент, дата по timezone клиента) -> индексы приёмов пищи
+    groups: dict[tuple[int, date], list[int]] = {}
+    for idx, meal in enumerate(meals):
+        target_date = meal.meal_time.astimezone(get_client_timezone(meal.client)).date()
+        groups.setdefault((meal.client_id, target_date), []).append(idx)
+
+    items = []
+    positions = []
+    for (_, target_date), indexes in groups.items():
+        client = meals[indexes[0]].client
+        program = get_active_program_for_client(client, target_date)
+        if not program or not program.track_compliance:
+            continue
+        program_day = get_program_day(program, target_date)
+        if not program_day:
+            continue
+
+        group = [meals[i] for i in indexes]
+        compliance_results = check_meal_compliance_bulk(
+            group, program_day, client_tz=get_client_timezone(client),
+        )
+        persona = client.persona or _default_persona(client.coach_id)
+        for idx, meal, result in zip(indexes, group, compliance_results):
+            feedback = generate_compliance_feedback(result, program_day, persona)
+            items.append((meal, program_day, result, feedback))
+            positions.append(idx)
+
+    for idx, check, item in zip(positions, create_compliance_checks_bulk(items), items):
+        results[idx] = (check, item[3])
+
+    return results
+
+
 def get_program_stats(program: NutritionProgram) -> dict:
     """
     Возвращает статистику по программе питания.
@@ -338,10 +479,14 @@ def get_program_stats(program: NutritionProgram) -> dict:
     Returns:
         Словарь со статистикой
     """
-    checks = MealComplianceCheck.objects.filter(program_day__program=program)
+    # Один запрос с условной агрегацией вместо двух count()
+    stats = MealComplianceCheck.objects.filter(program_day__program=program).aggregate(
+        total=Count('id'),
+        compliant=Count('id', filter=Q(is_compliant=True)),
+    )
 
-    total_meals = checks.count()
-    compliant_meals = checks.filter(is_compliant=True).count()
+    total_meals = stats['total']
+    compliant_meals = stats['compliant']
     violations = total_meals - compliant_meals
 
     compliance_percentage = (
@@ -356,6 +501,84 @@ def get_program_stats(program: NutritionProgram) -> dict:
     }
 
 
+def is_ai_refusal(content: str) -> bool:
+    """Проверяет, похож ли ответ AI на отказ анализировать фото (по началу ответа)."""
+    return bool(_REFUSAL_RE.search(content, 0, _REFUSAL_SCAN_LIMIT))
+
+
+class IngredientMatcher:
+    """
+    Fuzzy-поиск по списку ингредиентов, нормализованному один раз.
+
+    Для многократных запросов к одному списку (например, к разрешённым
+    ингредиентам дня программы) строится один раз и переиспользуется.
+    """
+
+    def __init__(self, ingredients_list: list[str]):
+        self.originals = ingredients_list
+        # token_sort_ratio с default_process == fuzz.ratio по нормализованным строкам
+        self.processed = [normalize_dish_text(i) for i in ingredients_list]
+        # Точные совпадения (после нормализации) — hash-lookup без fuzzy-scoring;
+        # при дублях побеждает первое вхождение, как и в extractOne
+        self._exact: dict[str, int] = {}
+        for idx, text in enumerate(self.processed):
+            self._exact.setdefault(text, idx)
+
+    def _normalize_query(self, ingredient: str) -> str:
+        if not self.processed or not ingredient or not ingredient.strip():
+            return ''
+        return normalize_dish_text(ingredient)
+
+    def _rank(self, query: str, threshold: int, limit: int | None) -> list[tuple[str, float]]:
+        # Кандидатов по длине rapidfuzz отсекает сам по score_cutoff
+        results = process.extract(
+            query,
+            self.processed,
+            scorer=fuzz.ratio,
+            processor=None,
+            score_cutoff=threshold,
+            limit=limit,
+        )
+        return [(self.originals[idx], score) for _, score, idx in results]
+
+    def match_all(
+        self,
+        ingredient: str,
+        threshold: int = 80,
+        limit: int | None = 3,
+    ) -> list[tuple[str, float]]:
+        """Совпадения с score >= threshold по убыванию score (при равенстве — по порядку списка)."""
+        query = self._normalize_query(ingredient)
+        if not query:
+            return []
+        return self._rank(query, threshold, limit)
+
+    def match(self, ingredient: str, threshold: int = 80) -> str | None:
+        """Наиболее похожий ингредиент из списка или None если совпадение < threshold."""
+        query = self._normalize_query(ingredient)
+        if not query:
+            return None
+        if threshold <= 100:
+            idx = self._exact.get(query)
+            if idx is not None:
+                return self.originals[idx]
+
+        found = self._rank(query, threshold, limit=1)
+        return found[0][0] if found else None
+
+
+@functools.lru_cache(maxsize=512)
+def _get_ingredient_matcher(ingredients: tuple[str, ...]) -> IngredientMatcher:
+    """
+    IngredientMatcher для списка ингредиентов, общий для всего процесса.
+
+    Ключ — содержимое списка, а не pk/updated_at дня: дни обновляются через
+    QuerySet.update(), который не трогает updated_at, а изменённый список
+    просто даёт новый ключ.
+    """
+    return IngredientMatcher(list(ingredients))
+
+
 def find_ingredient_match(
     ingredient: str,
     ingredients_list: list[str],
@@ -378,24 +601,223 @@ def find_ingredient_match(
         - "хлеб белый" → "белый хлеб" (match, порядок слов)
         - "яблоко" → "груша" (no match)
     """
-    if not ingredients_list or not ingredient or not ingredient.strip():
+    if not ingredients_list or not ingredient:
         return None
+    return _get_ingredient_matcher(tuple(ingredients_list)).match(ingredient, threshold)
+
+
+def build_ingredient_matcher(
+    ingredients_list: list[str],
+    threshold: int = 80,
+) -> Callable[[str], str | None]:
+    """
+    Создаёт функцию поиска ингредиента по заранее нормализованному списку.
+
+    Для многократного поиска по одному и тому же списку: список
+    нормализуется один раз, а не при каждом вызове find_ingredient_match.
+
+    Args:
+        ingredients_list: Список ингредиентов для сравнения
+        threshold: Минимальный порог совпадения (0-100)
+
+    Returns:
+        Функция ingredient -> найденный ингредиент из списка или None
+    """
+    return functools.partial(IngredientMatcher(ingredients_list).match, threshold=threshold)
+
+
+def bulk_find_ingredient_matches(
+    queries: list[str],
+    choices: list[str],
+    threshold: int = 80,
+) -> list[str | None]:
+    """
+    Находит совпадения для нескольких ингредиентов в одном списке.
+
+    Список choices нормализуется один раз и переиспользуется между вызовами
+    (списки дней программы повторяются от отчёта к отчёту), повторяющиеся
+    запросы оцениваются один раз.
+
+    Args:
+        queries: Ингредиенты для поиска
+        choices: Список ингредиентов для сравнения
+        threshold: Минимальный порог совпадения (0-100)
+
+    Returns:
+        Список найденных ингредиентов (или None) в порядке queries
+    """
+    if not choices:
+        return [None] * len(queries)
+    matcher = _get_ingredient_matcher(tuple(choices))
+    found: dict[str, str | None] = {}
+    for query in queries:
+        if query not in found:
+            found[query] = matcher.match(query, threshold)
+    return [found[query] for query in queries]
+
+
+# Названия типов приёмов пищи для промпта анализа фото
+_MEAL_TYPE_NAMES = dict(NutritionProgramDay.MEAL_TYPE_CHOICES)
+
+# Постоянные части промпта анализа фото-отчёта (analyze_meal_report):
+# на каждый запрос форматируются только данные клиента и плана
+_MEAL_REPORT_PROMPT_HEADER = """Ты — диетолог-помощник в приложении для трекинга питания. Клиент загрузил фото своего приёма пищи.
+Твоя задача — проанализировать еду на фото и сравнить с планом питания от коуча.
+
+КЛИЕНТ: {client_name}, пол: {gender_info}
+ВАЖНО: Обращайся к клиенту в правильном грамматическом роде! Если клиент — женщина, используй женский род ("ты выбрала", "молодец", "справилась"). Если мужчина — мужской род ("ты выбрал", "молодец", "справился").
+
+Это легитимный запрос для health-трекера. Пожалуйста, проанализируй фото.
+"""
+
+_MEAL_REPORT_PLANNED_INFO = """
+ЗАПЛАНИРОВАНО НА ЭТОТ ПРИЁМ ПИЩИ:
+- Название: {planned_name}
+- Описание от коуча: {planned_description}
+"""
+
+_MEAL_REPORT_PROMPT_RULES = """
+
+ВАЖНЫЕ ПРАВИЛА ОЦЕНКИ:
+
+1. СООТВЕТСТВИЕ ПЛАНУ — главный критерий. Сравнивай то что на фото с описанием блюда от коуча.
+
+2. На фото может быть НЕСКОЛЬКО блюд/компонентов — перечисли ВСЕ что видишь.
+
+3. УЧИТЫВАЙ КОНТЕКСТ ДНЯ (см. выше):
+   - Если это продолжение приёма пищи (ещё фото) — учти что уже было на предыдущих фото
+   - Если предыдущие приёмы были плохие, а этот хороший — отметь улучшение
+   - Если всё идёт хорошо — поддержи клиента
+
+4. Критерии оценки соответствия:
+   - Основное блюдо совпадает с планом? (каша = каша, салат = салат)
+   - Ключевые ингредиенты присутствуют?
+   - Общий характер блюда соответствует?
+
+5. НЕ снижай оценку за:
+   - Небольшие вариации в рамках той же категории продуктов
+   - Дополнительные полезные компоненты
+   - Конкретный продукт когда в плане указана общая категория (яблоко = фрукт, гречка = каша)
+   - Используй здравый смысл при оценке соответствия!
+
+6. СНИЖАЙ оценку за:
+   - Полностью другое блюдо (вместо каши — бутерброд)
+   - Отсутствие ключевых компонентов из плана
+   - Замену конкретного продукта на другой (в плане "индейка" → свинина НЕ подходит)
+   - Очевидно нездоровая замена
 
-    # Создаём список lowercase один раз для переиспользования
-    lower_list = [i.lower() for i in ingredients_list]
+7. В поле "analysis" ОБЯЗАТЕЛЬНО укажи:
+   - Что на фото соответствует плану и почему (например: "яблоко — отлично, в плане фрукт")
+   - Что НЕ соответствует и почему (например: "свинина вместо индейки — не по плану")
+   - Чего не хватает из плана (если что-то отсутствует)
+   Клиент должен понимать за что получил оценку!
+
+ОБЯЗАТЕЛЬНО верни JSON (без markdown, только чистый JSON):
+{
+  "dishes_on_photo": ["блюдо1", "блюдо2", ...],
+  "ingredients": ["ингредиент1", "ингредиент2", ...],
+  "calories": примерное_число_ккал,
+  "proteins": примерные_граммы_белка,
+  "fats": примерные_граммы_жиров,
+  "carbohydrates": примерные_граммы_углеводов,
+  "matches_plan": true/false,
+  "compliance_score": число_0_до_100,
+  "analysis": "Что на фото, как соотносится с планом, краткий вывод"
+}
+
+Оценка compliance_score:
+- 90-100: блюдо полностью соответствует плану коуча
+- 70-89: блюдо в целом соответствует (небольшие вариации)
+- 50-69: частичное соответствие (есть существенные отличия)
+- 30-49: значительные отклонения от плана
+- 0-29: блюдо не соответствует плану
+
+Если план не указан — оцени насколько блюдо выглядит здоровым и сбалансированным (score 50-80).
+Если не можешь определить блюдо — сделай приблизительную оценку на основе того, что видишь.
+"""
 
-    result = process.extractOne(
-        ingredient.lower(),
-        lower_list,
-        scorer=fuzz.token_sort_ratio,
+
+def get_persona_provider_config(
+    coach_id: int,
+    persona: BotPersona,
+    vision: bool = False,
+) -> tuple[str, AIProviderConfig | None]:
+    """
+    Провайдер AI персоны и активный конфиг коуча для него.
+
+    Args:
+        coach_id: ID коуча
+        persona: Персона бота
+        vision: Для анализа фото — сначала vision_provider, затем text_provider
+
+    Returns:
+        Кортеж (имя провайдера, AIProviderConfig или None)
+    """
+    provider_name = (vision and persona.vision_provider) or persona.text_provider or 'openai'
+    config = AIProviderConfig.objects.filter(
+        coach_id=coach_id, provider=provider_name, is_active=True
+    ).first()
+    return provider_name, config
+
+
+@dataclass
+class _MealReportContext:
+    """Данные из БД, нужные analyze_meal_report."""
+
+    program_day: NutritionProgramDay
+    program: NutritionProgram
+    client: Client
+    day_reports: list[dict] = field(default_factory=list)
+    bot: TelegramBot | None = None
+    persona: BotPersona | None = None
+    provider_name: str = ''
+    config: AIProviderConfig | None = None
+
+
+def _load_meal_report_context(meal_report: MealReport) -> _MealReportContext:
+    """
+    Загружает контекст анализа фото-отчёта синхронно, одним блоком.
+
+    Вызывается через один sync_to_async вместо отдельного перехода в
+    sync-поток на каждое обращение к связанным объектам.
+    """
+    program_day = NutritionProgramDay.objects.select_related(
+        'program__client__persona',
+        'program__client__coach',
+    ).get(pk=meal_report.program_day_id)
+    program = program_day.program
+    client = program.client
+    context = _MealReportContext(program_day=program_day, program=program, client=client)
+
+    if not program.track_compliance:
+        return context
+
+    context.day_reports = list(
+        MealReport.objects.filter(
+            program_day=program_day,
+        ).exclude(
+            pk=meal_report.pk  # Исключаем текущий отчёт
+        ).order_by('created_at').values(
+            'meal_type', 'ai_analysis', 'compliance_score', 'recognized_ingredients'
+        )
     )
 
-    if result and result[1] >= threshold:
-        # Возвращаем оригинальный ингредиент (с оригинальным регистром)
-        idx = lower_list.index(result[0])
-        return ingredients_list[idx]
+    context.bot = TelegramBot.objects.filter(coach=client.coach).first()
+    if not context.bot:
+        return context
 
-    return None
+    context.persona = (
+        client.persona
+        or _default_persona(client.coach_id)
+        or BotPersona.objects.filter(coach=client.coach).first()
+    )
+    if not context.persona:
+        return context
+
+    context.provider_name, context.config = get_persona_provider_config(
+        client.coach_id, context.persona, vision=True,
+    )
+    return context
 
 
 async def analyze_meal_report(
@@ -418,25 +840,13 @@ async def analyze_meal_report(
         - found_forbidden: найденные запрещённые ингредиенты
         - found_allowed: найденные разрешённые ингредиенты
     """
-    import json
-    import logging
-    from decimal import Decimal
-
-    from asgiref.sync import sync_to_async
-
-    from apps.persona.models import AIProviderConfig, AIUsageLog, BotPersona, TelegramBot
-    from core.ai.factory import get_ai_provider
-    from core.ai.model_fetcher import get_cached_pricing
-
-    logger = logging.getLogger(__name__)
-
-    # Получаем program_day и связанные данные
-    program_day = await sync_to_async(lambda: meal_report.program_day)()
-    program = await sync_to_async(lambda: program_day.program)()
-    client = await sync_to_async(lambda: program.client)()
+    # Весь контекст из БД — за один переход в sync-поток
+    context = await sync_to_async(_load_meal_report_context)(meal_report)
+    program_day = context.program_day
+    client = context.client
 
     # Если отслеживание выключено — возвращаем пустой результат
-    if not program.track_compliance:
+    if not context.program.track_compliance:
         return {
             'recognized_ingredients': [],
             'is_compliant': True,
@@ -461,19 +871,8 @@ async def analyze_meal_report(
         meal_report.planned_description = planned_description
         meal_report.meal_time = planned_meal.get('time', '')
 
-    # Загружаем ВСЕ фото-отчёты за ВЕСЬ день (для контекста)
-    from apps.nutrition_programs.models import MealReport
-    all_day_reports = await sync_to_async(
-        lambda: list(
-            MealReport.objects.filter(
-                program_day=program_day,
-            ).exclude(
-                pk=meal_report.pk  # Исключаем текущий отчёт
-            ).order_by('created_at').values(
-                'meal_type', 'ai_analysis', 'compliance_score', 'recognized_ingredients'
-            )
-        )
-    )()
+    # ВСЕ фото-отчёты за ВЕСЬ день (для контекста), без текущего
+    all_day_reports = context.day_reports
 
     # Определяем это первое фото за день или нет
     is_first_photo_today = len(all_day_reports) == 0
@@ -483,28 +882,18 @@ async def analyze_meal_report(
     other_meals_reports = [r for r in all_day_reports if r.get('meal_type') != meal_report.meal_type]
 
     # Получаем AI provider
-    bot = await sync_to_async(
-        lambda: TelegramBot.objects.filter(coach=client.coach).first()
-    )()
+    bot = context.bot
     if not bot:
         raise ValueError('No bot configured for client coach')
 
-    persona = await sync_to_async(lambda: client.persona)()
-    if not persona:
-        persona = await sync_to_async(
-            lambda: BotPersona.objects.filter(coach=bot.coach).first()
-        )()
+    persona = context.persona
     if not persona:
         raise ValueError(f'No BotPersona configured for coach {bot.coach_id}')
 
-    provider_name = persona.vision_provider or persona.text_provider or 'openai'
+    provider_name = context.provider_name
     model = persona.vision_model or persona.text_model or None
 
-    config = await sync_to_async(
-        lambda: AIProviderConfig.objects.filter(
-            coach=bot.coach, provider=provider_name, is_active=True
-        ).first()
-    )()
+    config = context.config
     if not config:
         raise ValueError(f'No API key for provider: {provider_name}')
 
@@ -513,20 +902,10 @@ async def analyze_meal_report(
     # Формируем промпт с учётом программы питания
     planned_info = ''
     if planned_name or planned_description:
-        planned_info = f"""
-ЗАПЛАНИРОВАНО НА ЭТОТ ПРИЁМ ПИЩИ:
-- Название: {planned_name}
-- Описание от коуча: {planned_description}
-"""
-
-    # Названия типов приёмов пищи
-    MEAL_TYPE_NAMES = {
-        'breakfast': 'Завтрак',
-        'snack1': 'Перекус 1',
-        'lunch': 'Обед',
-        'snack2': 'Перекус 2',
-        'dinner': 'Ужин',
-    }
+        planned_info = _MEAL_REPORT_PLANNED_INFO.format(
+            planned_name=planned_name,
+            planned_description=planned_description,
+        )
 
     # Формируем контекст дня
     day_context = ''
@@ -544,7 +923,7 @@ async def analyze_meal_report(
         # Сначала другие приёмы пищи за день
         if other_meals_reports:
             for report in other_meals_reports:
-                meal_type_name = MEAL_TYPE_NAMES.get(report.get('meal_type', ''), 'Приём пищи')
+                meal_type_name = _MEAL_TYPE_NAMES.get(report.get('meal_type', ''), 'Приём пищи')
                 score = report.get('compliance_score', 0)
                 ai_comment = report.get('ai_analysis', '')
                 if ai_comment and len(ai_comment) > 100:
@@ -557,116 +936,64 @@ async def analyze_meal_report(
         current_meal_photos = []
         if current_meal_reports:
             for i, report in enumerate(current_meal_reports, 1):
-                ingredients = report.get('recognized_ingredients', [])
-                ingredients_text = ', '.join(
-                    ing.get('name', ing) if isinstance(ing, dict) else str(ing)
-                    for ing in ingredients[:5]
-                ) if ingredients else 'не определено'
+                # Названия нормализуются один раз: dict без name не попадает в текст
+                names = [
+                    name for name in (
+                        ing.get('name', '') if isinstance(ing, dict) else str(ing)
+                        for ing in (report.get('recognized_ingredients') or [])[:5]
+                    ) if name
+                ]
+                ingredients_text = ', '.join(names) if names else 'не определено'
 
                 ai_comment = report.get('ai_analysis', '')
                 if ai_comment and len(ai_comment) > 100:
                     ai_comment = ai_comment[:100] + '...'
 
-                current_meal_photos.append(f"    Фото {i}: {ingredients_text}")
+                photo_parts = [f"    Фото {i}: {ingredients_text}"]
                 if ai_comment:
-                    current_meal_photos[-1] += f"\n      → {ai_comment}"
+                    photo_parts.append(f"\n      → {ai_comment}")
+                current_meal_photos.append(''.join(photo_parts))
 
-        day_context = f"""
+        # Части контекста собираются в список и склеиваются один раз
+        day_context_parts = [f"""
 КОНТЕКСТ ДНЯ (День {program_day.day_number}):
 Уже загружено приёмов пищи: {len(other_meals_reports) + (1 if current_meal_reports else 0)}
-"""
+"""]
         if day_summary_items:
-            day_context += f"""
+            day_summary_text = '\n'.join(day_summary_items)
+            day_context_parts.append(f"""
 Другие приёмы пищи сегодня:
-{chr(10).join(day_summary_items)}
-"""
+{day_summary_text}
+""")
         if current_meal_photos:
-            current_meal_name = MEAL_TYPE_NAMES.get(meal_report.meal_type, 'Текущий приём')
-            day_context += f"""
+            current_meal_name = _MEAL_TYPE_NAMES.get(meal_report.meal_type, 'Текущий приём')
+            current_meal_photos_text = '\n'.join(current_meal_photos)
+            day_context_parts.append(f"""
 Уже загружено фото для "{current_meal_name}":
-{chr(10).join(current_meal_photos)}
-"""
+{current_meal_photos_text}
+""")
         # Считаем общую статистику дня
         all_scores = [r.get('compliance_score', 0) for r in all_day_reports]
         if all_scores:
             avg_score = sum(all_scores) / len(all_scores)
             good_meals = sum(1 for s in all_scores if s >= 70)
             bad_meals = len(all_scores) - good_meals
-            day_context += f"""
+            day_context_parts.append(f"""
 Статистика дня: средняя оценка {avg_score:.0f}%, соответствует плану: {good_meals}, отклонения: {bad_meals}
 
 ВАЖНО: Учитывай контекст дня в ответе!
 - Если предыдущие приёмы были плохие, а этот хороший — похвали за улучшение
 - Если всё идёт хорошо — поддержи
 - Если это продолжение приёма пищи (ещё фото) — не повторяйся, дай итог
-"""
-
-    analysis_prompt = f"""Ты — диетолог-помощник в приложении для трекинга питания. Клиент загрузил фото своего приёма пищи.
-Твоя задача — проанализировать еду на фото и сравнить с планом питания от коуча.
+""")
+        day_context = ''.join(day_context_parts)
 
-КЛИЕНТ: {client_name}, пол: {gender_info}
-ВАЖНО: Обращайся к клиенту в правильном грамматическом роде! Если клиент — женщина, используй женский род ("ты выбрала", "молодец", "справилась"). Если мужчина — мужской род ("ты выбрал", "молодец", "справился").
-
-Это легитимный запрос для health-трекера. Пожалуйста, проанализируй фото.
-{planned_info}{day_context}
-
-ВАЖНЫЕ ПРАВИЛА ОЦЕНКИ:
-
-1. СООТВЕТСТВИЕ ПЛАНУ — главный критерий. Сравнивай то что на фото с описанием блюда от коуча.
-
-2. На фото может быть НЕСКОЛЬКО блюд/компонентов — перечисли ВСЕ что видишь.
-
-3. УЧИТЫВАЙ КОНТЕКСТ ДНЯ (см. выше):
-   - Если это продолжение приёма пищи (ещё фото) — учти что уже было на предыдущих фото
-   - Если предыдущие приёмы были плохие, а этот хороший — отметь улучшение
-   - Если всё идёт хорошо — поддержи клиента
-
-4. Критерии оценки соответствия:
-   - Основное блюдо совпадает с планом? (каша = каша, салат = салат)
-   - Ключевые ингредиенты присутствуют?
-   - Общий характер блюда соответствует?
-
-5. НЕ снижай оценку за:
-   - Небольшие вариации в рамках той же категории продуктов
-   - Дополнительные полезные компоненты
-   - Конкретный продукт когда в плане указана общая категория (яблоко = фрукт, гречка = каша)
-   - Используй здравый смысл при оценке соответствия!
-
-6. СНИЖАЙ оценку за:
-   - Полностью другое блюдо (вместо каши — бутерброд)
-   - Отсутствие ключевых компонентов из плана
-   - Замену конкретного продукта на другой (в плане "индейка" → свинина НЕ подходит)
-   - Очевидно нездоровая замена
-
-7. В поле "analysis" ОБЯЗАТЕЛЬНО укажи:
-   - Что на фото соответствует плану и почему (например: "яблоко — отлично, в плане фрукт")
-   - Что НЕ соответствует и почему (например: "свинина вместо индейки — не по плану")
-   - Чего не хватает из плана (если что-то отсутствует)
-   Клиент должен понимать за что получил оценку!
-
-ОБЯЗАТЕЛЬНО верни JSON (без markdown, только чистый JSON):
-{{
-  "dishes_on_photo": ["блюдо1", "блюдо2", ...],
-  "ingredients": ["ингредиент1", "ингредиент2", ...],
-  "calories": примерное_число_ккал,
-  "proteins": примерные_граммы_белка,
-  "fats": примерные_граммы_жиров,
-  "carbohydrates": примерные_граммы_углеводов,
-  "matches_plan": true/false,
-  "compliance_score": число_0_до_100,
-  "analysis": "Что на фото, как соотносится с планом, краткий вывод"
-}}
-
-Оценка compliance_score:
-- 90-100: блюдо полностью соответствует плану коуча
-- 70-89: блюдо в целом соответствует (небольшие вариации)
-- 50-69: частичное соответствие (есть существенные отличия)
-- 30-49: значительные отклонения от плана
-- 0-29: блюдо не соответствует плану
-
-Если план не указан — оцени насколько блюдо выглядит здоровым и сбалансированным (score 50-80).
-Если не можешь определить блюдо — сделай приблизительную оценку на основе того, что видишь.
-"""
+    analysis_prompt = ''.join([
+        _MEAL_REPORT_PROMPT_HEADER.format(client_name=client_name, gender_info=gender_info),
+        planned_info,
+        day_context,
+        _MEAL_REPORT_PROMPT_RULES,
+    ])
 
     logger.info(
         '[MEAL_REPORT] Analyzing report=%s meal_type=%s planned=%s',
@@ -682,20 +1009,16 @@ async def analyze_meal_report(
     )
 
     # Логируем использование AI
-    from core.ai.model_fetcher import log_ai_usage
     await log_ai_usage(client.coach, provider_name, model, response, task_type='vision', client=client)
 
     # Парсим ответ
     content = strip_markdown_codeblock(response.content)
 
-    # Проверяем не отказался ли AI анализировать
-    refusal_markers = ['извините', 'не могу', "i can't", "i cannot", "sorry", "unable to"]
-    is_refusal = any(marker in content.lower() for marker in refusal_markers)
-
     try:
-        data = json.loads(content)
+        data = json_loads(content)
     except json.JSONDecodeError:
-        if is_refusal:
+        # Проверяем не отказался ли AI анализировать
+        if is_ai_refusal(content):
             logger.warning('[MEAL_REPORT] AI refused to analyze image: %s', content[:200])
             data = {
                 'dish_name': 'Блюдо на фото',
@@ -723,7 +1046,11 @@ async def analyze_meal_report(
             }
 
     # Извлекаем данные из ответа AI
-    recognized = data.get('ingredients', [])
+    # Приводим ингредиенты к единому виду [{'name': ...}] один раз при разборе
+    recognized = [
+        ing if isinstance(ing, dict) else {'name': str(ing)}
+        for ing in data.get('ingredients') or []
+    ]
     dishes_on_photo = data.get('dishes_on_photo', [])
     # Для обратной совместимости: если dishes_on_photo пуст, используем dish_name
     if not dishes_on_photo:
@@ -744,10 +1071,7 @@ async def analyze_meal_report(
     ai_analysis = ai_analysis_text if ai_analysis_text else f'Распознано: {recognized_dish}'
 
     result = {
-        'recognized_ingredients': [
-            {'name': ing} if isinstance(ing, str) else ing
-            for ing in recognized
-        ],
+        'recognized_ingredients': recognized,
         'dishes_on_photo': dishes_on_photo,
         'is_compliant': is_compliant,
         'compliance_score': compliance_score,
@@ -765,7 +1089,15 @@ async def analyze_meal_report(
     meal_report.is_compliant = result['is_compliant']
     meal_report.compliance_score = result['compliance_score']
     meal_report.ai_analysis = result['ai_analysis']
-    await sync_to_async(meal_report.save)()
+    # Узкий UPDATE только изменённых полей — без перезаписи фото и прочих колонок
+    await sync_to_async(meal_report.save)(update_fields=[
+        'planned_description',
+        'meal_time',
+        'recognized_ingredients',
+        'is_compliant',
+        'compliance_score',
+        'ai_analysis',
+    ])
 
     logger.info(
         '[MEAL_REPORT] Analysis complete: report=%s compliant=%s score=%s dishes=%s',
@@ -793,19 +1125,6 @@ def find_all_matches(
     Returns:
         Список кортежей (ингредиент, score) отсортированных по убыванию score
     """
-    if not ingredients_list:
+    if not ingredients_list or not ingredient:
         return []
-
-    results = process.extract(
-        ingredient.lower(),
-        [i.lower() for i in ingredients_list],
-        scorer=fuzz.token_sort_ratio,
-        limit=limit,
-    )
-
-    matches = []
-    for match, score, idx in results:
-        if score >= threshold:
-            matches.append((ingredients_list[idx], score))
-
-    return matches
+    return _get_ingredient_matcher(tuple(ingredients_list)).match_all(ingredient, threshold, limit)
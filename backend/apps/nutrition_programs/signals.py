@@ -0,0 +1,18 @@
+"""Django signals для приложения nutrition_programs.
+
+Автоматические действия при сохранении/изменении моделей:
+- Сброс кэша персоны коуча по умолчанию при изменении персон
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.nutrition_programs.services import _default_persona
+from apps.persona.models import BotPersona
+
+
+@receiver(post_save, sender=BotPersona)
+@receiver(post_delete, sender=BotPersona)
+def reset_default_persona_cache(sender, instance: BotPersona, **kwargs) -> None:
+    """Персона создана/изменена/удалена — персона по умолчанию могла смениться."""
+    _default_persona.cache_clear()
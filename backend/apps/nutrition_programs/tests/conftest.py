@@ -1,14 +1,23 @@
 import pytest
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from rest_framework.test import APIClient
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken
 
 from apps.accounts.models import Coach, Client
+from apps.meals.models import Meal
 from apps.nutrition_programs.models import NutritionProgram, NutritionProgramDay
+from apps.nutrition_programs.services import _default_persona, process_meal_compliance_bulk
 
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def clear_default_persona_cache():
+    """Кэш персоны по умолчанию живёт в процессе, а pk коучей между тестами повторяются."""
+    _default_persona.cache_clear()
+
+
 @pytest.fixture
 def api_client():
     """Неаутентифицированный API клиент."""
@@ -76,8 +85,7 @@ def client_obj(coach):
 def authenticated_client(coach_user, coach):
     """Аутентифицированный API клиент (коуч)."""
     client = APIClient()
-    refresh = RefreshToken.for_user(coach_user)
-    client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(coach_user)}')
     client._coach = coach
     client._user = coach_user
     return client
@@ -87,8 +95,7 @@ def authenticated_client(coach_user, coach):
 def another_authenticated_client(another_coach_user, another_coach):
     """Аутентифицированный API клиент (другой коуч)."""
     client = APIClient()
-    refresh = RefreshToken.for_user(another_coach_user)
-    client.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(another_coach_user)}')
     client._coach = another_coach
     client._user = another_coach_user
     return client
@@ -109,14 +116,16 @@ def nutrition_program(client_obj, coach):
         status='draft',
     )
     # Создаём дни программы
-    for i in range(7):
-        NutritionProgramDay.objects.create(
+    NutritionProgramDay.objects.bulk_create([
+        NutritionProgramDay(
             program=program,
             day_number=i + 1,
             date=program.start_date + timedelta(days=i),
             allowed_ingredients=[{'name': 'курица'}, {'name': 'рис'}],
             forbidden_ingredients=[{'name': 'сахар'}, {'name': 'шоколад'}],
         )
+        for i in range(7)
+    ])
     return program
 
 
@@ -126,3 +135,34 @@ def active_program(nutrition_program):
     nutrition_program.status = 'active'
     nutrition_program.save()
     return nutrition_program
+
+
+@pytest.fixture
+def active_program_without_days(client_obj, coach):
+    """Активная программа без дней — для тестов, которым дни не нужны."""
+    from datetime import date
+
+    return NutritionProgram.objects.create(
+        client=client_obj,
+        coach=coach,
+        name='Тестовая программа',
+        description='Описание программы',
+        start_date=date.today(),
+        duration_days=7,
+        status='active',
+    )
+
+
+@pytest.fixture
+def create_checked_meals(client_obj):
+    """Фабрика: приёмы пищи клиента с указанными блюдами, проверенные на соответствие программе."""
+    def create(dish_names):
+        now = timezone.now()
+        meals = Meal.objects.bulk_create([
+            Meal(client=client_obj, dish_name=name, ingredients=[], meal_time=now)
+            for name in dish_names
+        ])
+        process_meal_compliance_bulk(meals)
+        return meals
+
+    return create
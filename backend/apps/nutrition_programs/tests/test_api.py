@@ -1,6 +1,7 @@
 """
 Тесты API для программ питания.
 """
+import codecs
 import pytest
 from datetime import date, timedelta
 from django.urls import reverse
@@ -8,6 +9,14 @@ from rest_framework import status
 
 from apps.nutrition_programs.models import NutritionProgram, NutritionProgramDay
 
+PROGRAMS_URL = '/api/nutrition/programs/'
+STATS_URL = '/api/nutrition/stats/'
+
+
+def program_url(program_id: int, suffix: str = '') -> str:
+    """URL программы или её вложенного ресурса (suffix — например 'activate/')."""
+    return f'{PROGRAMS_URL}{program_id}/{suffix}'
+
 
 @pytest.mark.django_db
 class TestNutritionProgramListCreate:
@@ -15,7 +24,7 @@ class TestNutritionProgramListCreate:
 
     def test_list_programs_authenticated(self, authenticated_client, nutrition_program):
         """Аутентифицированный коуч может получить список своих программ."""
-        url = '/api/nutrition/programs/'
+        url = PROGRAMS_URL
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -24,14 +33,14 @@ class TestNutritionProgramListCreate:
 
     def test_list_programs_unauthorized(self, api_client):
         """Неаутентифицированный пользователь не может получить список."""
-        url = '/api/nutrition/programs/'
+        url = PROGRAMS_URL
         response = api_client.get(url)
 
         assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
     def test_list_programs_other_coach(self, another_authenticated_client, nutrition_program):
         """Коуч не видит программы другого коуча."""
-        url = '/api/nutrition/programs/'
+        url = PROGRAMS_URL
         response = another_authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -39,7 +48,7 @@ class TestNutritionProgramListCreate:
 
     def test_create_program(self, authenticated_client, client_obj):
         """Коуч может создать программу питания."""
-        url = '/api/nutrition/programs/'
+        url = PROGRAMS_URL
         data = {
             'client': client_obj.id,
             'name': 'Новая программа',
@@ -55,11 +64,65 @@ class TestNutritionProgramListCreate:
         assert response.status_code == status.HTTP_201_CREATED
         assert response.data['name'] == 'Новая программа'
         assert response.data['duration_days'] == 14
-        assert NutritionProgram.objects.filter(name='Новая программа').exists()
+        assert NutritionProgram.objects.filter(client=client_obj, name='Новая программа').exists()
+
+    def test_create_program_deduplicates_ingredients(self, authenticated_client, client_obj):
+        """Дубли ингредиентов (без учёта регистра) и пустые названия отбрасываются."""
+        url = PROGRAMS_URL
+        data = {
+            'client': client_obj.id,
+            'name': 'Программа с дублями',
+            'start_date': str(date.today()),
+            'duration_days': 1,
+            'days': [
+                {
+                    'allowed_ingredients': [{'name': 'Яблоко'}, {'name': 'яблоко '}, {'name': ''}],
+                    'forbidden_ingredients': [{'name': 'сахар'}, {'name': 'САХАР'}],
+                },
+            ],
+        }
+        response = authenticated_client.post(url, data, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        day = NutritionProgramDay.objects.get(program__name='Программа с дублями')
+        assert day.allowed_ingredients == [{'name': 'Яблоко'}]
+        assert day.forbidden_ingredients == [{'name': 'сахар'}]
+
+    def test_create_program_invalid_day_payload(self, authenticated_client, client_obj):
+        """Некорректные типы в днях отклоняются на этапе валидации."""
+        url = PROGRAMS_URL
+        data = {
+            'client': client_obj.id,
+            'name': 'Программа с ошибкой',
+            'start_date': str(date.today()),
+            'duration_days': 1,
+            'days': [{'allowed_ingredients': 'яблоко'}],
+        }
+        response = authenticated_client.post(url, data, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'days' in response.data
+        assert not NutritionProgram.objects.filter(client=client_obj).exists()
+
+    def test_create_program_overlaps_active(self, authenticated_client, active_program):
+        """Нельзя создать программу, пересекающуюся по датам с активной."""
+        url = PROGRAMS_URL
+        data = {
+            'client': active_program.client_id,
+            'name': 'Пересекающаяся программа',
+            'start_date': str(active_program.start_date + timedelta(days=2)),
+            'duration_days': 7,
+        }
+        response = authenticated_client.post(url, data, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        message = str(response.data['start_date'][0])
+        assert active_program.name in message
+        assert str(active_program.end_date) in message
 
     def test_create_program_other_coach_client(self, another_authenticated_client, client_obj):
         """Коуч не может создать программу для клиента другого коуча."""
-        url = '/api/nutrition/programs/'
+        url = PROGRAMS_URL
         data = {
             'client': client_obj.id,
             'name': 'Программа чужого клиента',
@@ -77,7 +140,7 @@ class TestNutritionProgramDetail:
 
     def test_retrieve_program(self, authenticated_client, nutrition_program):
         """Коуч может просмотреть свою программу."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/'
+        url = program_url(nutrition_program.id)
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -87,14 +150,14 @@ class TestNutritionProgramDetail:
 
     def test_retrieve_other_coach_program(self, another_authenticated_client, nutrition_program):
         """Коуч не может просмотреть программу другого коуча."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/'
+        url = program_url(nutrition_program.id)
         response = another_authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_404_NOT_FOUND
 
     def test_update_program(self, authenticated_client, nutrition_program):
         """Коуч может обновить свою программу."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/'
+        url = program_url(nutrition_program.id)
         data = {
             'name': 'Обновлённая программа',
             'client': nutrition_program.client_id,
@@ -104,12 +167,12 @@ class TestNutritionProgramDetail:
         response = authenticated_client.put(url, data, format='json')
 
         assert response.status_code == status.HTTP_200_OK
-        nutrition_program.refresh_from_db()
+        nutrition_program.refresh_from_db(fields=['name'])
         assert nutrition_program.name == 'Обновлённая программа'
 
     def test_delete_program(self, authenticated_client, nutrition_program):
         """Коуч может удалить свою программу."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/'
+        url = program_url(nutrition_program.id)
         response = authenticated_client.delete(url)
 
         assert response.status_code == status.HTTP_204_NO_CONTENT
@@ -120,19 +183,25 @@ class TestNutritionProgramDetail:
 class TestNutritionProgramActions:
     """Тесты действий программы (активация, отмена)."""
 
-    def test_activate_program(self, authenticated_client, nutrition_program):
-        """Коуч может активировать программу."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/activate/'
+    @pytest.mark.parametrize('action,expected_status,program_fixture', [
+        ('activate', 'active', 'nutrition_program'),
+        ('cancel', 'cancelled', 'active_program'),
+        ('complete', 'completed', 'active_program'),
+    ])
+    def test_status_action(self, authenticated_client, request, action, expected_status, program_fixture):
+        """Коуч может активировать, отменить и завершить программу."""
+        program = request.getfixturevalue(program_fixture)
+        url = program_url(program.id, f'{action}/')
         response = authenticated_client.post(url)
 
         assert response.status_code == status.HTTP_200_OK
-        assert response.data['status'] == 'active'
-        nutrition_program.refresh_from_db()
-        assert nutrition_program.status == 'active'
+        assert response.data['status'] == expected_status
+        program.refresh_from_db(fields=['status'])
+        assert program.status == expected_status
 
     def test_activate_already_active(self, authenticated_client, active_program):
         """Нельзя активировать уже активную программу."""
-        url = f'/api/nutrition/programs/{active_program.id}/activate/'
+        url = program_url(active_program.id, 'activate/')
         response = authenticated_client.post(url)
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -148,32 +217,12 @@ class TestNutritionProgramActions:
             status='draft',
         )
 
-        url = f'/api/nutrition/programs/{expired_program.id}/activate/'
+        url = program_url(expired_program.id, 'activate/')
         response = authenticated_client.post(url)
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
         assert 'завершённую' in response.data['error']
 
-    def test_cancel_program(self, authenticated_client, active_program):
-        """Коуч может отменить программу."""
-        url = f'/api/nutrition/programs/{active_program.id}/cancel/'
-        response = authenticated_client.post(url)
-
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['status'] == 'cancelled'
-        active_program.refresh_from_db()
-        assert active_program.status == 'cancelled'
-
-    def test_complete_program(self, authenticated_client, active_program):
-        """Коуч может завершить программу."""
-        url = f'/api/nutrition/programs/{active_program.id}/complete/'
-        response = authenticated_client.post(url)
-
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['status'] == 'completed'
-        active_program.refresh_from_db()
-        assert active_program.status == 'completed'
-
     def test_activate_deactivates_other_programs(self, authenticated_client, nutrition_program, client_obj, coach):
         """При активации программы другие активные программы клиента завершаются."""
         # Создаём другую активную программу
@@ -186,11 +235,11 @@ class TestNutritionProgramActions:
             status='active',
         )
 
-        url = f'/api/nutrition/programs/{nutrition_program.id}/activate/'
+        url = program_url(nutrition_program.id, 'activate/')
         response = authenticated_client.post(url)
 
         assert response.status_code == status.HTTP_200_OK
-        other_program.refresh_from_db()
+        other_program.refresh_from_db(fields=['status'])
         assert other_program.status == 'completed'
 
 
@@ -200,7 +249,7 @@ class TestNutritionProgramDays:
 
     def test_list_program_days(self, authenticated_client, nutrition_program):
         """Коуч может получить список дней программы."""
-        url = f'/api/nutrition/programs/{nutrition_program.id}/days/'
+        url = program_url(nutrition_program.id, 'days/')
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -209,7 +258,7 @@ class TestNutritionProgramDays:
     def test_update_program_day(self, authenticated_client, nutrition_program):
         """Коуч может обновить день программы."""
         day = nutrition_program.days.first()
-        url = f'/api/nutrition/programs/{nutrition_program.id}/days/{day.id}/'
+        url = program_url(nutrition_program.id, f'days/{day.id}/')
         data = {
             'allowed_ingredients': [{'name': 'гречка'}, {'name': 'рыба'}],
             'forbidden_ingredients': [{'name': 'мучное'}],
@@ -233,7 +282,7 @@ class TestNutritionProgramDays:
         source_day.notes = 'Творожный день'
         source_day.save()
 
-        url = f'/api/nutrition/programs/{nutrition_program.id}/days/{target_day.id}/copy/'
+        url = program_url(nutrition_program.id, f'days/{target_day.id}/copy/')
         response = authenticated_client.post(url, {'source_day_id': source_day.id}, format='json')
 
         assert response.status_code == status.HTTP_200_OK
@@ -246,26 +295,26 @@ class TestNutritionProgramDays:
 class TestComplianceStats:
     """Тесты для статистики соблюдения."""
 
-    def test_list_stats(self, authenticated_client, active_program):
+    def test_list_stats(self, authenticated_client, active_program_without_days):
         """Коуч может получить статистику по программам."""
-        url = '/api/nutrition/stats/'
+        url = STATS_URL
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) >= 1
         assert response.data[0]['program_name'] == 'Тестовая программа'
 
-    def test_list_stats_filter_by_program(self, authenticated_client, active_program):
+    def test_list_stats_filter_by_program(self, authenticated_client, active_program_without_days):
         """Можно фильтровать статистику по программе."""
-        url = f'/api/nutrition/stats/?program_id={active_program.id}'
+        url = f'{STATS_URL}?program_id={active_program_without_days.id}'
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data) == 1
 
-    def test_violations_list(self, authenticated_client, active_program):
+    def test_violations_list(self, authenticated_client, active_program_without_days):
         """Коуч может получить список нарушений."""
-        url = '/api/nutrition/stats/violations/'
+        url = f'{STATS_URL}violations/'
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -273,31 +322,37 @@ class TestComplianceStats:
         assert response.data['count'] == 0
         assert len(response.data['results']) == 0
 
-    def test_export_stats_csv(self, authenticated_client, active_program):
+    def test_export_stats_csv(self, authenticated_client, active_program_without_days):
         """Коуч может экспортировать статистику в CSV."""
-        url = '/api/nutrition/stats/export-csv/'
+        url = f'{STATS_URL}export-csv/'
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response['Content-Type'] == 'text/csv; charset=utf-8'
-        assert 'attachment' in response['Content-Disposition']
-        assert 'nutrition_stats.csv' in response['Content-Disposition']
-
-        # Проверяем содержимое
-        content = response.content.decode('utf-8')
-        assert 'Программа' in content  # Header
-        assert 'Тестовая программа' in content  # Data
-
-    def test_export_violations_csv(self, authenticated_client, active_program):
+        assert response['Content-Disposition'] == 'attachment; filename="nutrition_stats.csv"'
+
+        # Проверяем содержимое: ответ отдаётся потоком по строкам
+        found_header = found_row = False
+        for chunk in response.streaming_content:
+            text = chunk.decode('utf-8')
+            found_header |= 'Программа' in text
+            found_row |= 'Тестовая программа' in text
+            if found_header and found_row:
+                break
+        assert found_header and found_row
+
+    def test_export_violations_csv(self, authenticated_client, active_program_without_days):
         """Коуч может экспортировать нарушения в CSV."""
-        url = '/api/nutrition/stats/export-csv/?type=violations'
+        url = f'{STATS_URL}export-csv/?type=violations'
         response = authenticated_client.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response['Content-Type'] == 'text/csv; charset=utf-8'
-        assert 'nutrition_violations.csv' in response['Content-Disposition']
-
-        # Проверяем заголовки
-        content = response.content.decode('utf-8')
-        assert 'Дата' in content
-        assert 'Клиент' in content
+        assert response['Content-Disposition'] == 'attachment; filename="nutrition_violations.csv"'
+
+        # Проверяем заголовки — первая строка потока, с BOM для Excel
+        first_chunk = next(iter(response.streaming_content))
+        assert first_chunk.startswith(codecs.BOM_UTF8)
+        header = first_chunk.decode('utf-8')
+        assert 'Дата' in header
+        assert 'Клиент' in header
@@ -5,7 +5,7 @@ import pytest
 from datetime import date, timedelta
 from rest_framework import status
 from rest_framework.test import APIClient
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken
 
 from apps.accounts.models import Coach, Client
 from apps.nutrition_programs.models import (
@@ -19,9 +19,11 @@ from apps.meals.models import Meal
 @pytest.fixture
 def client_token(client_obj, coach_user):
     """JWT токен для клиента miniapp с client_id в payload."""
-    refresh = RefreshToken.for_user(coach_user)
-    refresh['client_id'] = client_obj.id
-    return str(refresh.access_token)
+    # AccessToken напрямую: RefreshToken.for_user при подключённом
+    # token_blacklist ещё и записывает OutstandingToken в базу
+    token = AccessToken.for_user(coach_user)
+    token['client_id'] = client_obj.id
+    return str(token)
 
 
 @pytest.fixture
@@ -44,14 +46,16 @@ def active_program_today(client_obj, coach):
         duration_days=7,
         status='active',
     )
-    for i in range(7):
-        NutritionProgramDay.objects.create(
+    NutritionProgramDay.objects.bulk_create([
+        NutritionProgramDay(
             program=program,
             day_number=i + 1,
             date=program.start_date + timedelta(days=i),
             allowed_ingredients=[{'name': 'курица'}, {'name': 'рис'}],
             forbidden_ingredients=[{'name': 'сахар'}],
         )
+        for i in range(7)
+    ])
     return program
 
 
@@ -109,9 +113,11 @@ def compliant_meal(client_obj, active_program_today):
 class TestNutritionProgramTodayView:
     """Тесты GET /api/miniapp/nutrition-program/today/."""
 
-    def test_no_active_program(self, miniapp_client):
+    def test_no_active_program(self, miniapp_client, django_assert_num_queries):
         """Возвращает has_program=False если нет активной программы."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/today/')
+        # Аутентификация (пользователь и клиент) + один запрос программы
+        with django_assert_num_queries(3):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/today/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is False
@@ -127,9 +133,15 @@ class TestNutritionProgramTodayView:
         assert 'allowed_ingredients' in response.data
         assert 'forbidden_ingredients' in response.data
 
-    def test_with_meals_stats(self, miniapp_client, active_program_today, compliant_meal, meal_with_violation):
+    def test_with_meals_stats(
+        self, miniapp_client, active_program_today, compliant_meal, meal_with_violation,
+        django_assert_max_num_queries,
+    ):
         """Возвращает статистику по приёмам пищи за сегодня."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/today/')
+        # 2 запроса на аутентификацию miniapp + программа, дни и проверки;
+        # число запросов не должно расти с количеством дней и приёмов пищи
+        with django_assert_max_num_queries(5):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/today/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['today_stats']['meals_count'] == 2
@@ -146,9 +158,10 @@ class TestNutritionProgramTodayView:
 class TestNutritionProgramHistoryView:
     """Тесты GET /api/miniapp/nutrition-program/history/."""
 
-    def test_no_program(self, miniapp_client):
+    def test_no_program(self, miniapp_client, django_assert_num_queries):
         """Возвращает has_program=False если нет программ."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
+        with django_assert_num_queries(3):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is False
@@ -162,9 +175,12 @@ class TestNutritionProgramHistoryView:
         assert response.data['program_name'] == 'Активная программа'
         assert len(response.data['days']) == 7
 
-    def test_with_violations(self, miniapp_client, active_program_today, meal_with_violation):
+    def test_with_violations(
+        self, miniapp_client, active_program_today, meal_with_violation, django_assert_max_num_queries,
+    ):
         """Возвращает историю с нарушениями."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
+        with django_assert_max_num_queries(5):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
 
         assert response.status_code == status.HTTP_200_OK
         day1 = response.data['days'][0]
@@ -173,9 +189,13 @@ class TestNutritionProgramHistoryView:
         assert len(day1['violations']) == 1
         assert day1['violations'][0]['meal_name'] == 'Торт с сахаром'
 
-    def test_compliance_rate(self, miniapp_client, active_program_today, compliant_meal, meal_with_violation):
+    def test_compliance_rate(
+        self, miniapp_client, active_program_today, compliant_meal, meal_with_violation,
+        django_assert_max_num_queries,
+    ):
         """Рассчитывает правильный compliance_rate."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
+        with django_assert_max_num_queries(5):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/history/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['compliance_rate'] == 50  # 1 из 2
@@ -192,9 +212,12 @@ class TestNutritionProgramViolationsView:
         assert response.status_code == status.HTTP_200_OK
         assert response.data['violations'] == []
 
-    def test_with_violations(self, miniapp_client, active_program_today, meal_with_violation):
+    def test_with_violations(
+        self, miniapp_client, active_program_today, meal_with_violation, django_assert_max_num_queries,
+    ):
         """Возвращает список нарушений."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/violations/')
+        with django_assert_max_num_queries(3):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/violations/')
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['violations']) == 1
@@ -214,9 +237,10 @@ class TestNutritionProgramViolationsView:
 class TestNutritionProgramSummaryView:
     """Тесты GET /api/miniapp/nutrition-program/summary/."""
 
-    def test_no_active_program(self, miniapp_client):
+    def test_no_active_program(self, miniapp_client, django_assert_num_queries):
         """Возвращает has_program=False если нет активной программы."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/summary/')
+        with django_assert_num_queries(3):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/summary/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is False
@@ -231,9 +255,13 @@ class TestNutritionProgramSummaryView:
         assert response.data['current_day'] == 1
         assert response.data['total_days'] == 7
 
-    def test_compliance_rate(self, miniapp_client, active_program_today, compliant_meal, meal_with_violation):
+    def test_compliance_rate(
+        self, miniapp_client, active_program_today, compliant_meal, meal_with_violation,
+        django_assert_max_num_queries,
+    ):
         """Рассчитывает правильный compliance_rate."""
-        response = miniapp_client.get('/api/miniapp/nutrition-program/summary/')
+        with django_assert_max_num_queries(5):
+            response = miniapp_client.get('/api/miniapp/nutrition-program/summary/')
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['compliance_rate'] == 50
@@ -7,7 +7,7 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken
 
 from apps.accounts.models import Coach, Client
 from apps.meals.models import Meal
@@ -20,6 +20,17 @@ from apps.nutrition_programs.services import process_meal_compliance
 
 User = get_user_model()
 
+URL_TODAY = '/api/miniapp/nutrition-program/today/'
+URL_HISTORY = '/api/miniapp/nutrition-program/history/'
+URL_VIOLATIONS = '/api/miniapp/nutrition-program/violations/'
+URL_SUMMARY = '/api/miniapp/nutrition-program/summary/'
+URL_MEAL_REPORT = '/api/miniapp/nutrition-program/meal-report/'
+URL_MEAL_REPORTS = '/api/miniapp/nutrition-program/meal-reports/'
+
+# Соответствие оценивается по названию блюда относительно плана на приём пищи
+PLANNED_DISH = 'Курица с рисом'
+VIOLATION_DISH = 'Шоколадный торт'
+
 
 @pytest.fixture
 def client_user(db):
@@ -37,11 +48,11 @@ def client_user(db):
 def client_api(client_user, client_obj):
     """Аутентифицированный API клиент для miniapp."""
     api = APIClient()
-    refresh = RefreshToken.for_user(client_user)
+    token = AccessToken.for_user(client_user)
     # Добавляем client_id в claims токена
-    refresh['client_id'] = client_obj.pk
-    refresh['coach_id'] = client_obj.coach_id
-    api.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+    token['client_id'] = client_obj.pk
+    token['coach_id'] = client_obj.coach_id
+    api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
     return api
 
 
@@ -74,37 +85,64 @@ def another_client_user(db):
 def another_client_api(another_client_user, another_client_obj):
     """API клиент для другого клиента."""
     api = APIClient()
-    refresh = RefreshToken.for_user(another_client_user)
-    refresh['client_id'] = another_client_obj.pk
-    refresh['coach_id'] = another_client_obj.coach_id
-    api.credentials(HTTP_AUTHORIZATION=f'Bearer {str(refresh.access_token)}')
+    token = AccessToken.for_user(another_client_user)
+    token['client_id'] = another_client_obj.pk
+    token['coach_id'] = another_client_obj.coach_id
+    api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
     return api
 
 
+@pytest.fixture
+def planned_program(active_program):
+    """Активная программа с планом PLANNED_DISH на каждый приём пищи."""
+    active_program.days.update(meals=[
+        {'type': meal_type, 'name': PLANNED_DISH, 'description': ''}
+        for meal_type in ('breakfast', 'snack1', 'lunch', 'snack2', 'dinner')
+    ])
+    return active_program
+
+
 @pytest.mark.django_db
-class TestNutritionProgramTodayView:
-    """Тесты /api/miniapp/nutrition-program/today/."""
+@pytest.mark.parametrize('url', [URL_TODAY, URL_HISTORY, URL_VIOLATIONS, URL_SUMMARY, URL_MEAL_REPORTS])
+def test_unauthorized(api_client, url):
+    """Неавторизованный GET к miniapp API возвращает 401."""
+    response = api_client.get(url)
 
-    def test_no_program(self, client_api):
-        """Возвращает has_program=false если нет программы."""
-        url = '/api/miniapp/nutrition-program/today/'
-        response = client_api.get(url)
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
 
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['has_program'] is False
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('url,key,expected', [
+    (URL_TODAY, 'has_program', False),
+    (URL_HISTORY, 'has_program', False),
+    (URL_SUMMARY, 'has_program', False),
+    (URL_MEAL_REPORTS, 'reports', []),
+])
+def test_no_program(client_api, url, key, expected):
+    """Без программы miniapp API отвечает 200 с пустыми данными."""
+    response = client_api.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data[key] == expected
+
+
+@pytest.mark.django_db
+class TestNutritionProgramTodayView:
+    """Тесты /api/miniapp/nutrition-program/today/."""
 
     def test_draft_program_not_shown(self, client_api, nutrition_program):
         """Draft программа не показывается как активная."""
-        url = '/api/miniapp/nutrition-program/today/'
+        url = URL_TODAY
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is False
 
-    def test_active_program(self, client_api, active_program):
+    def test_active_program(self, client_api, active_program, django_assert_num_queries):
         """Возвращает данные активной программы."""
-        url = '/api/miniapp/nutrition-program/today/'
-        response = client_api.get(url)
+        url = URL_TODAY
+        with django_assert_num_queries(5):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is True
@@ -116,26 +154,14 @@ class TestNutritionProgramTodayView:
         assert 'forbidden_ingredients' in response.data
         assert 'today_stats' in response.data
 
-    def test_today_stats(self, client_api, active_program, client_obj):
+    def test_today_stats(self, client_api, planned_program, create_checked_meals, django_assert_num_queries):
         """Возвращает статистику за сегодня."""
         # Создаём meals и compliance checks
-        meal1 = Meal.objects.create(
-            client=client_obj,
-            dish_name='Курица',
-            ingredients=[{'name': 'курица'}],
-            meal_time=timezone.now(),
-        )
-        meal2 = Meal.objects.create(
-            client=client_obj,
-            dish_name='Шоколад',
-            ingredients=[{'name': 'шоколад'}],
-            meal_time=timezone.now(),
-        )
-        process_meal_compliance(meal1)
-        process_meal_compliance(meal2)
+        create_checked_meals([PLANNED_DISH, VIOLATION_DISH])
 
-        url = '/api/miniapp/nutrition-program/today/'
-        response = client_api.get(url)
+        url = URL_TODAY
+        with django_assert_num_queries(5):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         stats = response.data['today_stats']
@@ -143,27 +169,14 @@ class TestNutritionProgramTodayView:
         assert stats['compliant_meals'] == 1
         assert stats['violations_count'] == 1
 
-    def test_unauthorized(self, api_client):
-        """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/today/'
-        response = api_client.get(url)
-
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
 
 @pytest.mark.django_db
 class TestNutritionProgramHistoryView:
     """Тесты /api/miniapp/nutrition-program/history/."""
 
-    def test_no_program(self, client_api):
-        """Возвращает has_program=false если нет программы."""
-        url = '/api/miniapp/nutrition-program/history/'
-        response = client_api.get(url)
-
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['has_program'] is False
-
-    def test_program_history(self, client_api, active_program, client_obj):
+    def test_program_history(
+        self, client_api, active_program, planned_program, client_obj, django_assert_num_queries,
+    ):
         """Возвращает историю программы с днями."""
         # Создаём meal и violation
         meal = Meal.objects.create(
@@ -174,8 +187,9 @@ class TestNutritionProgramHistoryView:
         )
         process_meal_compliance(meal)
 
-        url = '/api/miniapp/nutrition-program/history/'
-        response = client_api.get(url)
+        url = URL_HISTORY
+        with django_assert_num_queries(5):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is True
@@ -191,40 +205,18 @@ class TestNutritionProgramHistoryView:
         assert len(day1['violations']) == 1
         assert day1['violations'][0]['meal_name'] == 'Шоколад'
 
-    def test_compliance_rate(self, client_api, active_program, client_obj):
+    def test_compliance_rate(self, client_api, planned_program, create_checked_meals, django_assert_num_queries):
         """Возвращает процент соблюдения."""
         # Создаём 2 compliant и 2 violation meals
-        for name in ['курица', 'рис']:
-            meal = Meal.objects.create(
-                client=client_obj,
-                dish_name=name.capitalize(),
-                ingredients=[{'name': name}],
-                meal_time=timezone.now(),
-            )
-            process_meal_compliance(meal)
-
-        for name in ['шоколад', 'сахар']:
-            meal = Meal.objects.create(
-                client=client_obj,
-                dish_name=name.capitalize(),
-                ingredients=[{'name': name}],
-                meal_time=timezone.now(),
-            )
-            process_meal_compliance(meal)
-
-        url = '/api/miniapp/nutrition-program/history/'
-        response = client_api.get(url)
+        create_checked_meals([PLANNED_DISH, PLANNED_DISH, VIOLATION_DISH, 'Сахар'])
+
+        url = URL_HISTORY
+        with django_assert_num_queries(5):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['compliance_rate'] == 50  # 2 из 4
 
-    def test_unauthorized(self, api_client):
-        """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/history/'
-        response = api_client.get(url)
-
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
 
 @pytest.mark.django_db
 class TestNutritionProgramViolationsView:
@@ -232,26 +224,20 @@ class TestNutritionProgramViolationsView:
 
     def test_empty_violations(self, client_api, active_program):
         """Возвращает пустой список если нет нарушений."""
-        url = '/api/miniapp/nutrition-program/violations/'
+        url = URL_VIOLATIONS
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['violations'] == []
 
-    def test_list_violations(self, client_api, active_program, client_obj):
+    def test_list_violations(self, client_api, planned_program, create_checked_meals, django_assert_num_queries):
         """Возвращает список нарушений."""
         # Создаём meals с нарушениями
-        for name in ['шоколад', 'сахар']:
-            meal = Meal.objects.create(
-                client=client_obj,
-                dish_name=name.capitalize(),
-                ingredients=[{'name': name}],
-                meal_time=timezone.now(),
-            )
-            process_meal_compliance(meal)
-
-        url = '/api/miniapp/nutrition-program/violations/'
-        response = client_api.get(url)
+        create_checked_meals([VIOLATION_DISH, 'Сахар'])
+
+        url = URL_VIOLATIONS
+        with django_assert_num_queries(3):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['violations']) == 2
@@ -266,64 +252,33 @@ class TestNutritionProgramViolationsView:
         assert 'day_number' in violation
         assert 'found_forbidden' in violation
 
-    def test_violations_limit(self, client_api, active_program, client_obj):
+    def test_violations_limit(self, client_api, planned_program, create_checked_meals, django_assert_num_queries):
         """Ограничение количества результатов."""
         # Создаём 5 нарушений
-        for i in range(5):
-            meal = Meal.objects.create(
-                client=client_obj,
-                dish_name=f'Шоколад {i}',
-                ingredients=[{'name': 'шоколад'}],
-                meal_time=timezone.now(),
-            )
-            process_meal_compliance(meal)
-
-        url = '/api/miniapp/nutrition-program/violations/?limit=3'
-        response = client_api.get(url)
+        create_checked_meals([f'Шоколад {i}' for i in range(5)])
+
+        url = f'{URL_VIOLATIONS}?limit=3'
+        with django_assert_num_queries(3):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['violations']) == 3
 
-    def test_unauthorized(self, api_client):
-        """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/violations/'
-        response = api_client.get(url)
-
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
 
 @pytest.mark.django_db
 class TestNutritionProgramSummaryView:
     """Тесты /api/miniapp/nutrition-program/summary/."""
 
-    def test_no_program(self, client_api):
-        """Возвращает has_program=false если нет программы."""
-        url = '/api/miniapp/nutrition-program/summary/'
-        response = client_api.get(url)
-
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['has_program'] is False
-
-    def test_summary_data(self, client_api, active_program, client_obj):
+    def test_summary_data(
+        self, client_api, active_program, planned_program, create_checked_meals, django_assert_num_queries,
+    ):
         """Возвращает краткую сводку для dashboard."""
         # Создаём meals
-        meal1 = Meal.objects.create(
-            client=client_obj,
-            dish_name='Курица',
-            ingredients=[{'name': 'курица'}],
-            meal_time=timezone.now(),
-        )
-        meal2 = Meal.objects.create(
-            client=client_obj,
-            dish_name='Шоколад',
-            ingredients=[{'name': 'шоколад'}],
-            meal_time=timezone.now(),
-        )
-        process_meal_compliance(meal1)
-        process_meal_compliance(meal2)
+        create_checked_meals([PLANNED_DISH, VIOLATION_DISH])
 
-        url = '/api/miniapp/nutrition-program/summary/'
-        response = client_api.get(url)
+        url = URL_SUMMARY
+        with django_assert_num_queries(5):
+            response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
         assert response.data['has_program'] is True
@@ -334,13 +289,6 @@ class TestNutritionProgramSummaryView:
         assert response.data['total_days'] == 7
         assert response.data['compliance_rate'] == 50
 
-    def test_unauthorized(self, api_client):
-        """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/summary/'
-        response = api_client.get(url)
-
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
-
 
 @pytest.mark.django_db
 class TestClientIsolation:
@@ -354,7 +302,7 @@ class TestClientIsolation:
     ):
         """Клиент видит только свою программу."""
         # Первый клиент видит программу
-        url = '/api/miniapp/nutrition-program/today/'
+        url = URL_TODAY
         response1 = client_api.get(url)
         assert response1.data['has_program'] is True
 
@@ -366,21 +314,21 @@ class TestClientIsolation:
         self,
         client_api,
         another_client_api,
-        active_program,
+        planned_program,
         client_obj,
     ):
         """Клиент видит только свои нарушения."""
         # Создаём нарушение для первого клиента
         meal = Meal.objects.create(
             client=client_obj,
-            dish_name='Шоколад',
-            ingredients=[{'name': 'шоколад'}],
+            dish_name=VIOLATION_DISH,
+            ingredients=[],
             meal_time=timezone.now(),
         )
         process_meal_compliance(meal)
 
         # Первый клиент видит нарушение
-        url = '/api/miniapp/nutrition-program/violations/'
+        url = URL_VIOLATIONS
         response1 = client_api.get(url)
         assert len(response1.data['violations']) == 1
 
@@ -404,7 +352,7 @@ class TestMealReportCreateView:
             b'\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82'
         ).decode()
 
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'breakfast',
             'photo_base64': png_data,
@@ -416,7 +364,7 @@ class TestMealReportCreateView:
 
     def test_create_report_with_file_id(self, client_api, active_program):
         """Создание отчёта с Telegram file_id."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'lunch',
             'photo_file_id': 'AgACAgIAAxkBAAI...',
@@ -428,7 +376,7 @@ class TestMealReportCreateView:
 
     def test_create_report_with_url(self, client_api, active_program):
         """Создание отчёта с URL фото."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'dinner',
             'photo_url': 'https://example.com/photo.jpg',
@@ -438,9 +386,9 @@ class TestMealReportCreateView:
         assert response.data['meal_type'] == 'dinner'
         assert response.data['photo_url'] == 'https://example.com/photo.jpg'
 
-    def test_update_existing_report(self, client_api, active_program):
-        """Обновление существующего отчёта."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+    def test_several_reports_same_meal_type(self, client_api, active_program):
+        """Несколько фото на один приём пищи — отдельные отчёты."""
+        url = URL_MEAL_REPORT
 
         # Первый отчёт
         response1 = client_api.post(url, {
@@ -448,20 +396,20 @@ class TestMealReportCreateView:
             'photo_file_id': 'old_file_id',
         })
         assert response1.status_code == status.HTTP_201_CREATED
-        report_id = response1.data['id']
 
-        # Обновляем отчёт
+        # Второй отчёт на тот же приём пищи
         response2 = client_api.post(url, {
             'meal_type': 'breakfast',
             'photo_file_id': 'new_file_id',
         })
         assert response2.status_code == status.HTTP_201_CREATED
-        assert response2.data['id'] == report_id  # Тот же ID
+        assert response2.data['id'] != response1.data['id']
         assert response2.data['photo_file_id'] == 'new_file_id'
+        assert response1.data['photo_file_id'] == 'old_file_id'
 
     def test_no_active_program(self, client_api):
         """Ошибка если нет активной программы."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'breakfast',
             'photo_file_id': 'some_id',
@@ -472,7 +420,7 @@ class TestMealReportCreateView:
 
     def test_invalid_meal_type(self, client_api, active_program):
         """Ошибка при некорректном meal_type."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'invalid_type',
             'photo_file_id': 'some_id',
@@ -482,7 +430,7 @@ class TestMealReportCreateView:
 
     def test_no_photo_provided(self, client_api, active_program):
         """Ошибка если не передано фото."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = client_api.post(url, {
             'meal_type': 'breakfast',
         })
@@ -491,7 +439,7 @@ class TestMealReportCreateView:
 
     def test_report_for_specific_date(self, client_api, active_program):
         """Загрузка отчёта за конкретную дату."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         tomorrow = (date.today() + timedelta(days=1)).isoformat()
 
         response = client_api.post(url, {
@@ -504,7 +452,7 @@ class TestMealReportCreateView:
 
     def test_unauthorized(self, api_client):
         """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/meal-report/'
+        url = URL_MEAL_REPORT
         response = api_client.post(url, {
             'meal_type': 'breakfast',
             'photo_file_id': 'some_id',
@@ -519,7 +467,7 @@ class TestMealReportsListView:
 
     def test_empty_list(self, client_api, active_program):
         """Пустой список если нет отчётов."""
-        url = '/api/miniapp/nutrition-program/meal-reports/'
+        url = URL_MEAL_REPORTS
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -528,7 +476,7 @@ class TestMealReportsListView:
     def test_list_reports_today(self, client_api, active_program):
         """Получение отчётов за сегодня."""
         # Создаём отчёт
-        create_url = '/api/miniapp/nutrition-program/meal-report/'
+        create_url = URL_MEAL_REPORT
         client_api.post(create_url, {
             'meal_type': 'breakfast',
             'photo_file_id': 'file_id_1',
@@ -539,7 +487,7 @@ class TestMealReportsListView:
         })
 
         # Получаем список
-        url = '/api/miniapp/nutrition-program/meal-reports/'
+        url = URL_MEAL_REPORTS
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -549,7 +497,7 @@ class TestMealReportsListView:
     def test_list_reports_by_date(self, client_api, active_program):
         """Получение отчётов за конкретную дату."""
         # Создаём отчёт на завтра
-        create_url = '/api/miniapp/nutrition-program/meal-report/'
+        create_url = URL_MEAL_REPORT
         tomorrow = (date.today() + timedelta(days=1)).isoformat()
         client_api.post(create_url, {
             'meal_type': 'breakfast',
@@ -558,7 +506,7 @@ class TestMealReportsListView:
         })
 
         # Получаем список за завтра
-        url = f'/api/miniapp/nutrition-program/meal-reports/?date={tomorrow}'
+        url = f'{URL_MEAL_REPORTS}?date={tomorrow}'
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_200_OK
@@ -566,28 +514,13 @@ class TestMealReportsListView:
         assert response.data['date'] == tomorrow
 
         # За сегодня - пусто
-        url_today = '/api/miniapp/nutrition-program/meal-reports/'
+        url_today = URL_MEAL_REPORTS
         response_today = client_api.get(url_today)
         assert len(response_today.data['reports']) == 0
 
     def test_invalid_date_format(self, client_api, active_program):
         """Ошибка при некорректном формате даты."""
-        url = '/api/miniapp/nutrition-program/meal-reports/?date=invalid'
+        url = f'{URL_MEAL_REPORTS}?date=invalid'
         response = client_api.get(url)
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
-
-    def test_no_program(self, client_api):
-        """Пустой список если нет программы."""
-        url = '/api/miniapp/nutrition-program/meal-reports/'
-        response = client_api.get(url)
-
-        assert response.status_code == status.HTTP_200_OK
-        assert response.data['reports'] == []
-
-    def test_unauthorized(self, api_client):
-        """Неавторизованный запрос возвращает 401."""
-        url = '/api/miniapp/nutrition-program/meal-reports/'
-        response = api_client.get(url)
-
-        assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -3,19 +3,33 @@
 """
 import pytest
 from datetime import date, timedelta
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from rapidfuzz import fuzz
 
 from apps.nutrition_programs.services import (
+    _default_persona,
+    IngredientMatcher,
+    analyze_meal_report,
+    build_ingredient_matcher,
+    bulk_find_ingredient_matches,
     find_ingredient_match,
     find_all_matches,
     check_meal_compliance,
+    check_meal_compliance_bulk,
+    create_compliance_checks_bulk,
     generate_compliance_feedback,
     get_active_program_for_client,
+    get_client_timezone,
+    get_meal_type_by_time,
     get_program_day,
+    get_program_stats,
+    is_ai_refusal,
     process_meal_compliance,
+    process_meal_compliance_bulk,
     ComplianceResult,
 )
-from apps.nutrition_programs.models import NutritionProgram, NutritionProgramDay, MealComplianceCheck
+from apps.nutrition_programs.models import MealComplianceCheck, MealReport, NutritionProgram, NutritionProgramDay
 
 
 @pytest.mark.django_db
@@ -57,6 +71,10 @@ class TestFindIngredientMatch:
         result = find_ingredient_match('яблоко', [])
         assert result is None
 
+    def test_empty_ingredient(self):
+        """Пустой ингредиент не ищется."""
+        assert find_ingredient_match('', ['яблоко']) is None
+
     def test_threshold(self):
         """Порог совпадения."""
         # Совпадение выше порога
@@ -67,6 +85,61 @@ class TestFindIngredientMatch:
         result = find_ingredient_match('яблоко', ['апельсин'], threshold=80)
         assert result is None
 
+    def test_matcher_reuses_list(self):
+        """Переиспользуемый matcher даёт те же результаты, что find_ingredient_match."""
+        ingredients = ['Сахар белый', 'Куриная грудка', 'хлеб белый']
+        match = build_ingredient_matcher(ingredients)
+
+        for query in ['куринная грудка', 'белый хлеб', 'яблоко', '']:
+            assert match(query) == find_ingredient_match(query, ingredients)
+        assert match('КУРИНАЯ ГРУДКА') == 'Куриная грудка'
+
+    def test_ingredient_matcher_match_all(self):
+        """Один IngredientMatcher обслуживает и match, и match_all."""
+        matcher = IngredientMatcher(['рис', 'рис бурый', 'Рис'])
+
+        assert matcher.processed == ['рис', 'бурый рис', 'рис']
+        assert matcher.match('РИС') == 'рис'
+        assert matcher.match_all('рис', threshold=100) == [('рис', 100.0), ('Рис', 100.0)]
+        assert matcher.match_all('рис', threshold=50, limit=None)[-1][0] == 'рис бурый'
+
+    def test_exact_match_skips_fuzzy(self):
+        """Точное совпадение находится без fuzzy-scoring, при дублях — первое вхождение."""
+        matcher = IngredientMatcher(['хлеб белый', 'Белый  хлеб', 'сахар'])
+
+        with patch('apps.nutrition_programs.services.process.extract') as extract:
+            assert matcher.match('белый хлеб') == 'хлеб белый'
+        extract.assert_not_called()
+
+    def test_bulk_matches(self):
+        """Пакетный поиск возвращает совпадения в порядке запросов."""
+        result = bulk_find_ingredient_matches(
+            ['сахар', 'яблоко', 'белый хлеб'],
+            ['Сахар', 'хлеб белый'],
+        )
+        assert result == ['Сахар', None, 'хлеб белый']
+
+    def test_bulk_matches_repeated_queries(self):
+        """Повторяющиеся запросы оцениваются один раз."""
+        with patch.object(IngredientMatcher, 'match', autospec=True, return_value='Сахар') as match:
+            result = bulk_find_ingredient_matches(['сахар', 'соль', 'сахар'], ['Сахар'])
+
+        assert result == ['Сахар', 'Сахар', 'Сахар']
+        assert match.call_count == 2
+
+    def test_bulk_matches_reuse_matcher(self):
+        """Один и тот же список нормализуется один раз на процесс."""
+        choices = ['Сахар', 'хлеб белый']
+        bulk_find_ingredient_matches(['сахар'], choices)
+
+        with patch.object(IngredientMatcher, '__init__', side_effect=AssertionError) as init:
+            assert bulk_find_ingredient_matches(['белый хлеб'], list(choices)) == ['хлеб белый']
+        init.assert_not_called()
+
+    def test_bulk_matches_empty_choices(self):
+        """Пустой список для сравнения — ни одного совпадения."""
+        assert bulk_find_ingredient_matches(['сахар', 'соль'], []) == [None, None]
+
 
 @pytest.mark.django_db
 class TestFindAllMatches:
@@ -96,6 +169,11 @@ class TestFindAllMatches:
             for i in range(len(result) - 1):
                 assert result[i][1] >= result[i + 1][1]
 
+    def test_empty_list(self):
+        """Пустой список — без совпадений."""
+        assert find_all_matches('курица', []) == []
+        assert find_all_matches('', ['курица']) == []
+
 
 @pytest.mark.django_db
 class TestCheckMealCompliance:
@@ -161,6 +239,88 @@ class TestCheckMealCompliance:
         assert result.is_compliant is True
 
 
+@pytest.mark.django_db
+class TestCheckMealComplianceBulk:
+    """Тесты пакетной проверки соответствия приёмов пищи плану."""
+
+    @pytest.fixture
+    def program_day(self, nutrition_program):
+        day = nutrition_program.days.first()
+        day.meals = [
+            {'type': 'breakfast', 'name': 'Овсянка', 'description': 'с ягодами'},
+            {'type': 'lunch', 'name': 'Курица', 'description': 'с рисом'},
+        ]
+        day.save()
+        return day
+
+    @staticmethod
+    def _meal(dish_name, hour):
+        from datetime import datetime, timezone as dt_timezone
+
+        meal = MagicMock()
+        meal.dish_name = dish_name
+        meal.meal_time = datetime(2026, 1, 1, hour, 0, tzinfo=dt_timezone.utc)
+        return meal
+
+    def test_results_in_input_order(self, program_day):
+        """Результаты возвращаются в порядке входных приёмов пищи."""
+        meals = [
+            self._meal('Овсянка с ягодами', 8),
+            self._meal('Бургер', 13),
+            self._meal('Курица с рисом', 13),
+        ]
+
+        results = check_meal_compliance_bulk(meals, program_day)
+
+        assert [r.meal_type for r in results] == ['breakfast', 'lunch', 'lunch']
+        assert results[0].is_compliant is True
+        assert results[1].is_compliant is False
+        assert results[2].is_compliant is True
+        assert results[2].planned_meal['name'] == 'Курица'
+
+    def test_matches_single_check(self, program_day):
+        """Пакетная проверка совпадает с проверкой по одному приёму пищи."""
+        meal = self._meal('Рис с курицей', 13)
+
+        bulk = check_meal_compliance_bulk([meal], program_day)[0]
+        single = check_meal_compliance(meal, program_day)
+
+        assert bulk == single
+
+    def test_repeated_dish_scored_once(self, program_day):
+        """Повторяющееся блюдо одного типа оценивается один раз за вызов."""
+        meals = [self._meal('Овсянка с ягодами', 8) for _ in range(3)] + [self._meal('Овсянка с ягодами', 13)]
+
+        with patch('apps.nutrition_programs.services.fuzz.ratio', wraps=fuzz.ratio) as ratio:
+            results = check_meal_compliance_bulk(meals, program_day)
+
+        assert ratio.call_count == 2
+        assert len({r.compliance_score for r in results[:3]}) == 1
+
+    def test_normalized_planned_text_cached(self, program_day):
+        """Нормализованный текст плана кэшируется и сбрасывается при save()."""
+        assert program_day.get_normalized_planned_text('lunch') == 'курица рисом с'
+
+        program_day.meals = [{'type': 'lunch', 'name': 'Рыба', 'description': ''}]
+        assert program_day.get_normalized_planned_text('lunch') == 'курица рисом с'
+
+        program_day.save()
+        assert program_day.get_normalized_planned_text('lunch') == 'рыба'
+
+    def test_punctuation_ignored(self, program_day):
+        """Пунктуация и порядок слов не влияют на оценку."""
+        result = check_meal_compliance_bulk([self._meal('С рисом, курица!', 13)], program_day)[0]
+
+        assert result.compliance_score == 100
+
+    def test_no_planned_meal(self, program_day):
+        """Без запланированного блюда используется score по умолчанию."""
+        results = check_meal_compliance_bulk([self._meal('Яблоко', 19)], program_day)
+
+        assert results[0].compliance_score == 70
+        assert results[0].planned_meal is None
+
+
 @pytest.mark.django_db
 class TestGenerateComplianceFeedback:
     """Тесты генерации обратной связи."""
@@ -201,6 +361,71 @@ class TestGenerateComplianceFeedback:
         assert 'рекомендуется' in feedback.lower() or 'программе' in feedback.lower()
 
 
+class TestIsAiRefusal:
+    """Тесты определения отказа AI."""
+
+    @pytest.mark.parametrize('content', [
+        'Извините, я не могу анализировать это изображение.',
+        "I CAN'T help with that.",
+        'Sorry, unable to process.',
+        'I cannot identify people.',
+    ])
+    def test_refusal(self, content):
+        assert is_ai_refusal(content) is True
+
+    def test_not_refusal(self):
+        assert is_ai_refusal('{"dishes_on_photo": ["Овсянка"], "compliance_score": 90}') is False
+
+    def test_marker_far_from_start_ignored(self):
+        """Маркер глубоко в теле ответа не считается отказом."""
+        assert is_ai_refusal('x' * 1000 + ' sorry') is False
+
+
+class TestGetMealTypeByTime:
+    """Тесты определения типа приёма пищи по времени."""
+
+    @pytest.mark.parametrize('hour,expected', [
+        (0, 'dinner'), (5, 'dinner'), (6, 'breakfast'), (9, 'breakfast'),
+        (10, 'snack1'), (12, 'lunch'), (14, 'lunch'), (15, 'snack2'),
+        (18, 'dinner'), (21, 'dinner'), (22, 'snack2'), (23, 'snack2'),
+    ])
+    def test_hour_boundaries(self, hour, expected):
+        from datetime import datetime
+
+        assert get_meal_type_by_time(datetime(2026, 1, 1, hour, 30)) == expected
+
+    def test_client_timezone_applied(self):
+        """Время переводится в timezone клиента перед определением типа."""
+        from datetime import datetime, timezone as dt_timezone
+        from zoneinfo import ZoneInfo
+
+        meal_time = datetime(2026, 1, 1, 5, 0, tzinfo=dt_timezone.utc)  # 8:00 по Москве
+
+        assert get_meal_type_by_time(meal_time, ZoneInfo('Europe/Moscow')) == 'breakfast'
+
+
+class TestGetClientTimezone:
+    """Тесты получения timezone клиента."""
+
+    def test_client_timezone(self):
+        client = MagicMock(timezone='Asia/Tokyo')
+
+        assert str(get_client_timezone(client)) == 'Asia/Tokyo'
+
+    @pytest.mark.parametrize('tz_name', ['', None, 'Mars/Olympus', '../etc'])
+    def test_invalid_timezone_fallback(self, tz_name):
+        """Пустой или невалидный timezone — используется дефолтный."""
+        client = MagicMock(timezone=tz_name)
+
+        assert str(get_client_timezone(client)) == 'Europe/Moscow'
+
+    def test_timezone_cached(self):
+        """Повторные вызовы возвращают один и тот же объект."""
+        client = MagicMock(timezone='Asia/Tokyo')
+
+        assert get_client_timezone(client) is get_client_timezone(client)
+
+
 @pytest.mark.django_db
 class TestGetActiveProgramForClient:
     """Тесты получения активной программы клиента."""
@@ -254,6 +479,101 @@ class TestGetProgramDay:
 
         assert result is None
 
+    def test_program_not_requeried(self, active_program, django_assert_num_queries):
+        """Программа найденного дня не запрашивается повторно."""
+        with django_assert_num_queries(1):
+            result = get_program_day(active_program, date.today())
+            assert result.program.name == active_program.name
+
+
+@pytest.mark.django_db
+class TestGetProgramStats:
+    """Тесты статистики по программе."""
+
+    def test_stats_single_query(self, active_program, client_obj, django_assert_num_queries):
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        day = active_program.days.first()
+        for i, is_compliant in enumerate([True, True, False]):
+            meal = Meal.objects.create(
+                client=client_obj,
+                dish_name=f'Блюдо {i}',
+                ingredients=[],
+                meal_time=timezone.now(),
+            )
+            MealComplianceCheck.objects.create(meal=meal, program_day=day, is_compliant=is_compliant)
+
+        with django_assert_num_queries(1):
+            stats = get_program_stats(active_program)
+
+        assert stats == {
+            'total_meals': 3,
+            'compliant_meals': 2,
+            'violations': 1,
+            'compliance_percentage': 67,
+        }
+
+    def test_stats_empty(self, active_program):
+        stats = get_program_stats(active_program)
+
+        assert stats['total_meals'] == 0
+        assert stats['compliance_percentage'] == 0
+
+
+@pytest.mark.django_db
+class TestCreateComplianceChecksBulk:
+    """Тесты пакетного сохранения проверок соответствия."""
+
+    def test_single_insert(self, nutrition_program, client_obj, django_assert_num_queries):
+        """Все проверки сохраняются одним INSERT в порядке входных данных."""
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        day = nutrition_program.days.first()
+        meals = [
+            Meal.objects.create(client=client_obj, dish_name=name, ingredients=[], meal_time=timezone.now())
+            for name in ('Овсянка', 'Бургер')
+        ]
+        items = [
+            (meals[0], day, ComplianceResult(is_compliant=True, compliance_score=90), 'Отлично'),
+            (meals[1], day, ComplianceResult(is_compliant=False, compliance_score=20, ai_analysis='Не по плану'), ''),
+        ]
+
+        with django_assert_num_queries(1):
+            checks = create_compliance_checks_bulk(items)
+
+        assert [c.is_compliant for c in checks] == [True, False]
+        assert [c.ai_comment for c in checks] == ['Отлично', 'Не по плану']
+        assert MealComplianceCheck.objects.filter(program_day=day).count() == 2
+
+
+@pytest.mark.django_db
+class TestDefaultPersona:
+    """Тесты кэша персоны коуча по умолчанию."""
+
+    def test_cached(self, coach, django_assert_num_queries):
+        """Повторный вызов для того же коуча не ходит в БД."""
+        from apps.persona.models import BotPersona
+
+        persona = BotPersona.objects.create(coach=coach, is_default=True)
+        assert _default_persona(coach.pk) == persona
+
+        with django_assert_num_queries(0):
+            assert _default_persona(coach.pk) == persona
+
+    def test_reset_on_save_and_delete(self, coach):
+        """Сохранение и удаление персоны сбрасывают кэш."""
+        from apps.persona.models import BotPersona
+
+        assert _default_persona(coach.pk) is None
+
+        persona = BotPersona.objects.create(coach=coach, is_default=True)
+        assert _default_persona(coach.pk) == persona
+
+        persona.delete()
+        assert _default_persona(coach.pk) is None
+
 
 @pytest.mark.django_db
 class TestProcessMealCompliance:
@@ -295,3 +615,168 @@ class TestProcessMealCompliance:
 
         assert check is None
         assert feedback == ''
+
+    def test_program_activated_after_meal(self, nutrition_program, client_obj):
+        """Программа, активированная после приёма пищи без неё, учитывается сразу."""
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        meal = Meal.objects.create(client=client_obj, dish_name='Тест', ingredients=[], meal_time=timezone.now())
+        assert process_meal_compliance(meal) == (None, '')
+
+        nutrition_program.status = 'active'
+        nutrition_program.save()
+
+        check, _ = process_meal_compliance(meal)
+        assert check is not None
+
+    def test_day_by_number_not_date(self, active_program, client_obj):
+        """День ищется по номеру от start_date, даже если даты дней устарели."""
+        from datetime import timedelta
+
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        # Как после смены start_date без сдвига дат дней
+        for program_day in active_program.days.all():
+            program_day.date += timedelta(days=10)
+            program_day.save(update_fields=['date'])
+
+        meal = Meal.objects.create(client=client_obj, dish_name='Тест', ingredients=[], meal_time=timezone.now())
+        check, _ = process_meal_compliance(meal, target_date=active_program.start_date + timedelta(days=2))
+
+        assert check.program_day.day_number == 3
+
+    def test_bulk(self, active_program, client_obj, django_assert_num_queries):
+        """Пакетная проверка: один поиск программы, дня и персоны и один INSERT."""
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        now = timezone.now()
+        meals = Meal.objects.bulk_create([
+            Meal(client=client_obj, dish_name=name, ingredients=[], meal_time=now)
+            for name in ('Курица с рисом', 'Торт', 'Курица с рисом')
+        ])
+
+        with django_assert_num_queries(4):
+            results = process_meal_compliance_bulk(meals)
+
+        assert [check.meal for check, _ in results] == meals
+        assert all(check.program_day.program_id == active_program.id for check, _ in results)
+        assert all(feedback for _, feedback in results)
+        assert MealComplianceCheck.objects.filter(meal__in=meals).count() == 3
+
+    def test_bulk_no_active_program(self, nutrition_program, client_obj):
+        """Без активной программы проверки не создаются."""
+        from apps.meals.models import Meal
+        from django.utils import timezone
+
+        meal = Meal.objects.create(client=client_obj, dish_name='Тест', ingredients=[], meal_time=timezone.now())
+
+        assert process_meal_compliance_bulk([meal]) == [(None, '')]
+        assert not MealComplianceCheck.objects.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+class TestAnalyzeMealReport:
+    """Тесты анализа фото-отчёта (AI провайдер замокан)."""
+
+    @pytest.fixture
+    def meal_report(self, active_program, coach):
+        from apps.persona.models import AIProviderConfig, BotPersona, TelegramBot
+
+        TelegramBot.objects.create(coach=coach, name='Тестовый', token='token')
+        BotPersona.objects.create(coach=coach, vision_provider='openai', vision_model='gpt-4o')
+        AIProviderConfig.objects.create(coach=coach, provider='openai', api_key='key')
+
+        day = active_program.days.first()
+        day.meals = [{'type': 'breakfast', 'name': 'Овсянка', 'description': 'с ягодами', 'time': '8:00'}]
+        day.save()
+        return MealReport.objects.create(program_day=day, meal_type='breakfast')
+
+    @staticmethod
+    async def _analyze(meal_report, content):
+        provider = MagicMock()
+        provider.analyze_image = AsyncMock(return_value=MagicMock(content=content))
+        with patch('apps.nutrition_programs.services.get_ai_provider', return_value=provider), \
+                patch('apps.nutrition_programs.services.log_ai_usage', new=AsyncMock()):
+            return await analyze_meal_report(meal_report, b'image')
+
+    async def test_parses_ai_response(self, meal_report):
+        content = (
+            '{"dishes_on_photo": ["Овсянка"], "ingredients": ["овсянка", {"name": "сахар"}], '
+            '"compliance_score": 85, "matches_plan": true, "analysis": "Соответствует плану"}'
+        )
+
+        result = await self._analyze(meal_report, content)
+
+        assert result['compliance_score'] == 85
+        assert result['is_compliant'] is True
+        assert result['recognized_ingredients'] == [{'name': 'овсянка'}, {'name': 'сахар'}]
+        assert result['ai_analysis'] == 'Соответствует плану'
+
+        saved = await MealReport.objects.aget(pk=meal_report.pk)
+        assert saved.compliance_score == 85
+        assert saved.recognized_ingredients == [{'name': 'овсянка'}, {'name': 'сахар'}]
+
+    async def test_save_keeps_other_fields(self, meal_report):
+        """Сохранение результата не перезаписывает поля, которые анализ не менял."""
+        await MealReport.objects.filter(pk=meal_report.pk).aupdate(photo_url='https://example.com/new.jpg')
+
+        await self._analyze(meal_report, '{"compliance_score": 90, "matches_plan": true}')
+
+        saved = await MealReport.objects.aget(pk=meal_report.pk)
+        assert saved.photo_url == 'https://example.com/new.jpg'
+        assert saved.compliance_score == 90
+        assert saved.planned_description == 'с ягодами'
+        assert saved.meal_time == '8:00'
+
+    async def test_previous_photos_in_prompt(self, meal_report):
+        """Ингредиенты прошлых фото того же приёма попадают в промпт, dict без name пропускается."""
+        await MealReport.objects.acreate(
+            program_day_id=meal_report.program_day_id,
+            meal_type='breakfast',
+            recognized_ingredients=[{'weight': 100}, 'гречка', {'name': 'молоко'}],
+            compliance_score=80,
+        )
+        provider = MagicMock()
+        provider.analyze_image = AsyncMock(return_value=MagicMock(content='{"compliance_score": 80}'))
+
+        with patch('apps.nutrition_programs.services.get_ai_provider', return_value=provider), \
+                patch('apps.nutrition_programs.services.log_ai_usage', new=AsyncMock()):
+            await analyze_meal_report(meal_report, b'image')
+
+        prompt = provider.analyze_image.call_args.kwargs['prompt']
+        assert 'Фото 1: гречка, молоко' in prompt
+
+    async def test_refusal_response(self, meal_report):
+        result = await self._analyze(meal_report, 'Извините, я не могу помочь с этим.')
+
+        assert result['compliance_score'] == 50
+        assert 'более чёткое фото' in result['ai_analysis']
+
+    async def test_invalid_json(self, meal_report):
+        result = await self._analyze(meal_report, '{"dishes_on_photo": [')
+
+        assert result['compliance_score'] == 50
+        assert result['ai_analysis'] == 'Не удалось распознать блюдо на фото.'
+
+    async def test_tracking_disabled(self, meal_report):
+        """При выключенном отслеживании AI не вызывается."""
+        program = await NutritionProgram.objects.aget(days__meal_reports=meal_report)
+        program.track_compliance = False
+        await program.asave()
+
+        result = await self._analyze(meal_report, '{}')
+
+        assert result['compliance_score'] == 100
+        assert result['ai_analysis'] == ''
+
+    async def test_no_bot_configured(self, meal_report, coach):
+        from apps.persona.models import TelegramBot
+
+        await TelegramBot.objects.filter(coach=coach).adelete()
+
+        with pytest.raises(ValueError, match='No bot configured'):
+            await self._analyze(meal_report, '{}')
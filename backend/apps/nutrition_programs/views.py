@@ -1,11 +1,10 @@
 import csv
 from collections import Counter
-from io import StringIO
 
 from core.ai.utils import strip_markdown_codeblock
 
 from django.db.models import Count, Prefetch, Q
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
@@ -14,6 +13,31 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
 
+class _Echo:
+    """Псевдо-буфер для csv.writer: writerow возвращает готовую строку."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_response(filename: str, header: list, rows) -> StreamingHttpResponse:
+    """CSV-ответ, который отдаётся по строкам без сборки файла в памяти.
+
+    Файл начинается с BOM, иначе Excel открывает UTF-8 CSV с кириллицей
+    в системной кодировке.
+    """
+    writer = csv.writer(_Echo())
+
+    def stream():
+        yield '\ufeff' + writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 class ViolationsPagination(PageNumberPagination):
     """Пагинация для списка нарушений."""
 
@@ -701,11 +725,26 @@ class ComplianceStatsViewSet(viewsets.GenericViewSet):
             ),
         )
 
-        output = StringIO()
-        writer = csv.writer(output)
-
-        # Header
-        writer.writerow([
+        def rows():
+            for program in programs:
+                total = program._total_checks
+                compliant = program._compliant_checks
+                violations = total - compliant
+                rate = round(compliant / total * 100, 1) if total > 0 else 0
+
+                yield [
+                    program.name,
+                    f'{program.client.first_name} {program.client.last_name}'.strip(),
+                    program.get_status_display() if hasattr(program, 'get_status_display') else program.status,
+                    str(program.start_date),
+                    str(program.end_date),
+                    total,
+                    compliant,
+                    violations,
+                    f'{rate}%',
+                ]
+
+        return _csv_response('nutrition_stats.csv', [
             'Программа',
             'Клиент',
             'Статус',
@@ -715,30 +754,7 @@ class ComplianceStatsViewSet(viewsets.GenericViewSet):
             'Соблюдено',
             'Нарушений',
             '% соблюдения',
-        ])
-
-        # Data
-        for program in programs:
-            total = program._total_checks
-            compliant = program._compliant_checks
-            violations = total - compliant
-            rate = round(compliant / total * 100, 1) if total > 0 else 0
-
-            writer.writerow([
-                program.name,
-                f'{program.client.first_name} {program.client.last_name}'.strip(),
-                program.get_status_display() if hasattr(program, 'get_status_display') else program.status,
-                str(program.start_date),
-                str(program.end_date),
-                total,
-                compliant,
-                violations,
-                f'{rate}%',
-            ])
-
-        response = HttpResponse(output.getvalue(), content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="nutrition_stats.csv"'
-        return response
+        ], rows())
 
     def _export_violations_csv(self, coach, program_id, client_id):
         """Экспорт списка нарушений."""
@@ -757,11 +773,30 @@ class ComplianceStatsViewSet(viewsets.GenericViewSet):
         if client_id:
             checks = checks.filter(program_day__program__client_id=client_id)
 
-        output = StringIO()
-        writer = csv.writer(output)
+        def rows():
+            for check in checks.iterator(chunk_size=500):
+                meal = check.meal
+                program = check.program_day.program
+                client = program.client
+
+                # Форматируем запрещённые ингредиенты
+                forbidden = ', '.join(
+                    ing.get('name', str(ing)) if isinstance(ing, dict) else str(ing)
+                    for ing in check.found_forbidden
+                )
 
-        # Header
-        writer.writerow([
+                yield [
+                    meal.meal_time.strftime('%Y-%m-%d'),
+                    meal.meal_time.strftime('%H:%M'),
+                    f'{client.first_name} {client.last_name}'.strip(),
+                    program.name,
+                    check.program_day.day_number,
+                    meal.dish_name,
+                    forbidden,
+                    check.ai_comment or '',
+                ]
+
+        return _csv_response('nutrition_violations.csv', [
             'Дата',
             'Время',
             'Клиент',
@@ -770,31 +805,4 @@ class ComplianceStatsViewSet(viewsets.GenericViewSet):
             'Блюдо',
             'Запрещённые ингредиенты',
             'Комментарий AI',
-        ])
-
-        # Data
-        for check in checks:
-            meal = check.meal
-            program = check.program_day.program
-            client = program.client
-
-            # Форматируем запрещённые ингредиенты
-            forbidden = ', '.join(
-                ing.get('name', str(ing)) if isinstance(ing, dict) else str(ing)
-                for ing in check.found_forbidden
-            )
-
-            writer.writerow([
-                meal.meal_time.strftime('%Y-%m-%d'),
-                meal.meal_time.strftime('%H:%M'),
-                f'{client.first_name} {client.last_name}'.strip(),
-                program.name,
-                check.program_day.day_number,
-                meal.dish_name,
-                forbidden,
-                check.ai_comment or '',
-            ])
-
-        response = HttpResponse(output.getvalue(), content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="nutrition_violations.csv"'
-        return response
+        ], rows())
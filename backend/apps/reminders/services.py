@@ -2,7 +2,6 @@ import logging
 from datetime import datetime, timedelta
 
 import httpx
-import pytz
 from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.utils import timezone
@@ -13,6 +12,7 @@ from apps.bot.services import (
     _build_program_context,
     _build_workouts_context,
 )
+from apps.nutrition_programs.services import get_active_program_for_client, get_client_timezone, get_program_day
 from apps.persona.models import AIProviderConfig, BotPersona, TelegramBot
 from core.ai.factory import get_ai_provider
 from core.ai.model_fetcher import log_ai_usage_sync
@@ -83,14 +83,9 @@ MEAL_TYPE_LABELS = {
 
 def _build_meal_program_text(reminder: Reminder) -> str:
     """Строит текст напоминания о ближайшем приёме пищи из программы."""
-    from apps.nutrition_programs.services import get_active_program_for_client, get_program_day
-
     client = reminder.client
 
-    try:
-        client_tz = pytz.timezone(client.timezone or 'Europe/Moscow')
-    except pytz.exceptions.UnknownTimeZoneError:
-        client_tz = pytz.timezone('Europe/Moscow')
+    client_tz = get_client_timezone(client)
 
     now = timezone.now().astimezone(client_tz)
     today = now.date()
@@ -116,7 +111,7 @@ def _build_meal_program_text(reminder: Reminder) -> str:
         try:
             hour, minute = map(int, meal_time_str.split(':'))
             meal_dt = datetime.combine(today, datetime.min.time().replace(hour=hour, minute=minute))
-            meal_dt = client_tz.localize(meal_dt)
+            meal_dt = meal_dt.replace(tzinfo=client_tz)
             fire_dt = meal_dt - offset
             # Берём приём, до которого напоминание ещё актуально (±5 мин)
             if fire_dt <= now <= meal_dt + timedelta(minutes=5):
@@ -135,7 +130,7 @@ def _build_meal_program_text(reminder: Reminder) -> str:
             try:
                 hour, minute = map(int, meal_time_str.split(':'))
                 meal_dt = datetime.combine(today, datetime.min.time().replace(hour=hour, minute=minute))
-                meal_dt = client_tz.localize(meal_dt)
+                meal_dt = meal_dt.replace(tzinfo=client_tz)
                 if meal_dt > now:
                     if next_meal_dt is None or meal_dt < next_meal_dt:
                         next_meal = meal
@@ -218,10 +213,7 @@ def generate_morning_greeting(reminder: Reminder) -> str:
     coach = reminder.coach
 
     # Timezone
-    try:
-        client_tz = pytz.timezone(client.timezone or 'Europe/Moscow')
-    except pytz.exceptions.UnknownTimeZoneError:
-        client_tz = pytz.timezone('Europe/Moscow')
+    client_tz = get_client_timezone(client)
 
     today = timezone.now().astimezone(client_tz).date()
 
@@ -392,10 +384,7 @@ def compute_next_fire(reminder: Reminder) -> datetime | None:
     if not reminder.time:
         return None
 
-    try:
-        client_tz = pytz.timezone(reminder.client.timezone or 'Europe/Moscow')
-    except pytz.exceptions.UnknownTimeZoneError:
-        client_tz = pytz.timezone('Europe/Moscow')
+    client_tz = get_client_timezone(reminder.client)
 
     now = timezone.now()
     now_local = now.astimezone(client_tz)
@@ -405,14 +394,14 @@ def compute_next_fire(reminder: Reminder) -> datetime | None:
         if reminder.last_sent_at:
             return None
         fire_local = datetime.combine(today_local, reminder.time)
-        fire_local = client_tz.localize(fire_local)
+        fire_local = fire_local.replace(tzinfo=client_tz)
         if fire_local <= now:
             return None
         return fire_local
 
     elif reminder.frequency == 'daily':
         fire_local = datetime.combine(today_local, reminder.time)
-        fire_local = client_tz.localize(fire_local)
+        fire_local = fire_local.replace(tzinfo=client_tz)
         if fire_local <= now:
             fire_local += timedelta(days=1)
         return fire_local
@@ -427,13 +416,13 @@ def compute_next_fire(reminder: Reminder) -> datetime | None:
             weekday = candidate_date.isoweekday()
             if weekday in days:
                 fire_local = datetime.combine(candidate_date, reminder.time)
-                fire_local = client_tz.localize(fire_local)
+                fire_local = fire_local.replace(tzinfo=client_tz)
                 if fire_local > now:
                     return fire_local
 
     elif reminder.frequency == 'custom':
         fire_local = datetime.combine(today_local, reminder.time)
-        fire_local = client_tz.localize(fire_local)
+        fire_local = fire_local.replace(tzinfo=client_tz)
         if fire_local <= now:
             fire_local += timedelta(days=1)
         return fire_local
@@ -443,14 +432,9 @@ def compute_next_fire(reminder: Reminder) -> datetime | None:
 
 def _compute_meal_program_next_fire(reminder: Reminder) -> datetime | None:
     """Вычисляет next_fire_at для напоминания о приёме пищи по программе."""
-    from apps.nutrition_programs.services import get_active_program_for_client, get_program_day
-
     client = reminder.client
 
-    try:
-        client_tz = pytz.timezone(client.timezone or 'Europe/Moscow')
-    except pytz.exceptions.UnknownTimeZoneError:
-        client_tz = pytz.timezone('Europe/Moscow')
+    client_tz = get_client_timezone(client)
 
     now = timezone.now()
     now_local = now.astimezone(client_tz)
@@ -476,7 +460,7 @@ def _compute_meal_program_next_fire(reminder: Reminder) -> datetime | None:
         try:
             hour, minute = map(int, meal_time_str.split(':'))
             meal_dt = datetime.combine(today, datetime.min.time().replace(hour=hour, minute=minute))
-            meal_dt = client_tz.localize(meal_dt)
+            meal_dt = meal_dt.replace(tzinfo=client_tz)
             fire_dt = meal_dt - offset
             if fire_dt > now:
                 candidates.append(fire_dt)
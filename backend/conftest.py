@@ -0,0 +1,15 @@
+import pytest
+from django.test import override_settings
+
+
+@pytest.fixture(autouse=True, scope='session')
+def fast_password_hasher():
+    """
+    Быстрый хэшер паролей на время тестов.
+
+    Фикстуры создают пользователей через create_user, а PBKDF2 с сотнями
+    тысяч итераций — самая дорогая часть их создания. Пароли в тестах не
+    проверяются, поэтому стойкость хэша не важна.
+    """
+    with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+        yield